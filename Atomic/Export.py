@@ -3,7 +3,7 @@ export docker images, containers and volumes into a filesystem directory.
 """
 import os
 
-from .client import AtomicDocker
+from .client import AtomicDocker, invalidate_docker_cache
 from . import util
 
 ATOMIC_LIBEXEC = os.environ.get('ATOMIC_LIBEXEC', '/usr/libexec/atomic')
@@ -28,6 +28,7 @@ def export_docker(graph, export_location, force):
 
             util.write_out("Deleting dangling images")
             util.check_call([util.default_docker(), "rmi", "-f"]+dangling_images)
+            invalidate_docker_cache()
 
         #Save the docker storage driver
         storage_driver = client.info()["Driver"]
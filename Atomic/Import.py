@@ -5,6 +5,7 @@ import os
 import sys
 
 from . import util
+from .client import invalidate_docker_cache
 
 
 ATOMIC_LIBEXEC = os.environ.get('ATOMIC_LIBEXEC', '/usr/libexec/atomic')
@@ -43,6 +44,7 @@ def import_images(import_location):
         util.write_out("Importing image: {0}".format(image[:12]))
         with open(subdir + '/' + image) as f:
             util.check_call([util.default_docker(), "load"], stdin=f)
+    invalidate_docker_cache()
 
 def import_containers(graph, import_location):
     """
@@ -7,8 +7,9 @@ import pipes
 import getpass
 import argparse
 from datetime import datetime
-from .client import AtomicDocker
+from .client import AtomicDocker, invalidate_docker_cache, no_shaw
 from .syscontainers import SystemContainers
+from .resolver import ObjectResolver
 
 try:
     from subprocess import DEVNULL  # pylint: disable=no-name-in-module
@@ -35,25 +36,67 @@ def convert_size(size):
     return '0B'
 
 
-def find_repo_tag(d, Id, image_name):
-    def image_in_repotags(image_name, repotags):
-        if image_name in repotags:
-            return image_name
-        for repotag in repotags:
-            if repotag.startswith("{}:".format(image_name)):
+class LayerResolver(object):
+    """
+    Resolves the layer chain of Docker images.  The parent and labels of
+    every image come from a single images(all=True) listing, and images
+    missing from it are inspected at most once.
+    """
+    def __init__(self, d):
+        self.d = d
+        self._listing = None
+        self._by_id = None
+        self._children = None
+        self._inspected = {}
+
+    def _load(self):
+        if self._listing is not None:
+            return
+        self._listing = self.d.images(all=True)
+        self._by_id = {}
+        self._children = {}
+        for image in self._listing:
+            image["ParentId"] = no_shaw(image.get("ParentId") or "")
+            self._by_id[image["Id"]] = image
+            self._children.setdefault(image["ParentId"], []).append(image["Id"])
+
+    def inspect(self, image):
+        """
+        Memoized inspect_image, by name or ID.
+        """
+        if image not in self._inspected:
+            inspect = self.d.inspect_image(image)
+            self._inspected[image] = self._inspected[inspect["Id"]] = inspect
+        return self._inspected[image]
+
+    def listed(self, iid):
+        self._load()
+        return self._by_id.get(iid)
+
+    def repo_tag(self, iid, image_name):
+        """
+        Returns image_name if an image is tagged with it, else the first
+        tag of the image iid.  Intermediate images are not considered.
+        """
+        def image_in_repotags(image_name, repotags):
+            if image_name in repotags:
                 return image_name
-        return None
+            for repotag in repotags:
+                if repotag.startswith("{}:".format(image_name)):
+                    return image_name
+            return None
 
-    if not find_repo_tag.images:
-        find_repo_tag.images = d.images()
-    for image in find_repo_tag.images:
-        repo_tag = image_in_repotags(image_name, image['RepoTags'])
-        if repo_tag is not None:
-            return repo_tag
-        if Id == image["Id"]:
-            return image["RepoTags"][0]
-    return ""
-find_repo_tag.images = None
+        self._load()
+        for image in self._listing:
+            repotags = image.get("RepoTags") or []
+            if image["Id"] in self._children and all(x == "<none>:<none>" for x in repotags):
+                continue
+            repo_tag = image_in_repotags(image_name, repotags)
+            if repo_tag is not None:
+                return repo_tag
+            if iid == image["Id"] and repotags:
+                return repotags[0]
+        return ""
 
 class Atomic(object):
     INSTALL_ARGS = ["run",
@@ -114,15 +157,27 @@ class Atomic(object):
         self.user = None
         self.force = False
         self._images = []
-        self.containers = False
-        self.images_cache = []
-        self.images_all_cache = []
         self.active_containers = []
         self.docker_cmd = None
         self.debug = False
         self.is_python2 = (int(sys.version[0])) < 3
         self.useTTY = True
-        self.syscontainers = SystemContainers()
+        self._syscontainers = None
+        self._layer_resolver = None
+        self._resolver = None
+
+    @property
+    def syscontainers(self):
+        '''
+        The SystemContainers helper is only built when a system container
+        code path needs it, so that Docker-only commands do not parse the
+        configuration for it.
+        '''
+        if self._syscontainers is None:
+            self._syscontainers = SystemContainers()
+            if self.args is not None:
+                self._syscontainers.set_args(self.args)
+        return self._syscontainers
 
     def __enter__(self):
         return self
@@ -154,6 +209,10 @@ class Atomic(object):
                     self.d.remove_container(c["Id"], force=True)
 
     def update(self):
+        if hasattr(self.args, 'rollback') and self.args.rollback:
+            if self.syscontainers.get_system_container_checkout(self.args.image):
+                return self.syscontainers.rollback_system_container(self.args.image)
+            raise ValueError("Container '%s' is not installed" % self.args.image)
         if hasattr(self.args, 'container') and self.args.container:
             if self.syscontainers.get_system_container_checkout(self.args.image):
                 return self.syscontainers.update_system_container(self.args.image)
@@ -164,7 +223,10 @@ class Atomic(object):
         self.ping()
         if self.force:
             self.force_delete_containers()
-        return util.check_call([self.docker_binary(), "pull", self.image])
+        try:
+            return util.check_call([self.docker_binary(), "pull", self.image])
+        finally:
+            invalidate_docker_cache()
 
     def pull(self):
         prevstatus = ""
@@ -307,9 +369,12 @@ class Atomic(object):
             if self.spc:
                 self.name = self.name + "-spc"
             if self.system:
-                self.name = self.syscontainers.get_default_system_name(self.image)
+                self.name = SystemContainers.get_default_system_name(self.image)
 
-        self.syscontainers.set_args(self.args)
+        if self._syscontainers is not None:
+            self._syscontainers.set_args(self.args)
+        self._layer_resolver = None
+        self._resolver = None
 
     def _getconfig(self, key, default=None):
         assert self.inspect is not None
@@ -384,12 +449,18 @@ class Atomic(object):
 
     def _inspect_image(self, image=None):
         image = image or self.image
-        try:
-            if self.syscontainers.has_system_container_image(image):
-                return self.syscontainers.inspect_system_image(image)
-            return self.d.inspect_image(image)
-        except (NotFound, requests.exceptions.ConnectionError):
-            pass
+        # System image branches are looked for on disk, so that Docker
+        # images are inspected without loading OSTree
+        if self.syscontainers.has_system_container_branch(image):
+            return self.syscontainers.inspect_system_image(image)
+        if not image.startswith(("oci:", "ostree:")):
+            try:
+                return self.d.inspect_image(image)
+            except (NotFound, requests.exceptions.ConnectionError):
+                pass
+        # System images by ID, or by ostree: branch
+        if self.syscontainers.has_system_container_image(image):
+            return self.syscontainers.inspect_system_image(image)
         return None
 
     def _inspect_container(self, name=None):
@@ -548,7 +619,10 @@ class Atomic(object):
 
         if self.name == self.image:
             util.write_out("docker rmi %s" % self.image)
-            util.check_call([self.docker_binary(), "rmi", self.image])
+            try:
+                util.check_call([self.docker_binary(), "rmi", self.image])
+            finally:
+                invalidate_docker_cache()
 
     def cmd_env(self):
         os.environ['NAME'] = self.name or ""
@@ -611,10 +685,7 @@ class Atomic(object):
             return image_info['RepoTags'][0]
 
     def is_iid(self):
-        for i in self.get_images():
-            if i['Id'].startswith(self.image):
-                return True
-        return False
+        return len(self.resolver.images_by_id(self.image)) > 0
 
     def _no_such_image(self):
         raise ValueError("Could not find any image matching '{}'"
@@ -852,20 +923,30 @@ class Atomic(object):
     def print_uninstall(self):
         return "%s %s %s" % (self.docker_binary(), " ".join(self.INSTALL_ARGS), "/usr/bin/UNINSTALLCMD")
 
+    @property
+    def layer_resolver(self):
+        if self._layer_resolver is None:
+            self._layer_resolver = LayerResolver(self.d)
+        return self._layer_resolver
+
     def _get_layer(self, image):
-        def get_label(label):
-            return self.get_label(label, image["Id"])
-        image = self._inspect_image(image)
-        if not image:
-            raise ValueError("Image '%s' does not exist" % self.image)
-        version = ("%s-%s-%s" % (get_label("Name"), get_label("Version"),
-                                 get_label("Release"))).strip("-")
-        if 'Parent' in image:
-            parent = image['Parent']
+        resolver = self.layer_resolver
+        listed = resolver.listed(image)
+        if listed is not None:
+            iid = listed["Id"]
+            labels = listed.get("Labels") or {}
+            parent = listed["ParentId"]
         else:
-            parent = ""
-        return({"Id": image['Id'], "Name": get_label("Name"),
-                "Version": version, "Tag": find_repo_tag(self.d, image['Id'], self.image),
+            inspect = self._inspect_image(image)
+            if not inspect:
+                raise ValueError("Image '%s' does not exist" % self.image)
+            iid = inspect["Id"]
+            labels = (inspect.get("Config") or {}).get("Labels") or {}
+            parent = inspect.get("Parent", "")
+        version = ("%s-%s-%s" % (labels.get("Name", ""), labels.get("Version", ""),
+                                 labels.get("Release", ""))).strip("-")
+        return({"Id": iid, "Name": labels.get("Name", ""),
+                "Version": version, "Tag": resolver.repo_tag(iid, self.image),
                 "Parent": parent})
 
     def get_layers(self):
@@ -971,11 +1052,7 @@ class Atomic(object):
         that you want to only deal with active containers.
         '''
         if active:
-            active_cons = self.get_active_containers()
-            active_con_ids = [x['Id'] for x in active_cons]
-            cons = active_cons
-        else:
-            cons = self.get_containers()
+            active_con_ids = [x['Id'] for x in self.get_active_containers()]
 
         # First check if the container exists by whatever
         # identifier was given
@@ -992,12 +1069,9 @@ class Atomic(object):
         err_append = "Refine your search to narrow results."
 
         # The identifier might be a partial name?
-        con_ids = []
-        for con in cons:
-            for name in con['Names']:
-                if name.startswith("/{0}".format(identifier)):
-                    con_ids.append(con['Id'])
-                    break
+        con_ids = [con['Id'] for con in self.resolver.containers_by_name("/{0}".format(identifier))]
+        if active:
+            con_ids = [x for x in con_ids if x in active_con_ids]
 
         # More than one match was found
         if len(con_ids) > 1:
@@ -1020,7 +1094,6 @@ class Atomic(object):
         return an AtomicError.
         '''
         err_append = "Refine your search to narrow results."
-        image_info = self.get_images()
 
         inspect = self._inspect_image(image=identifier)
 
@@ -1028,13 +1101,12 @@ class Atomic(object):
             self.inspect = inspect
             return inspect['Id']
 
-        name_search = util.image_by_name(identifier, images=image_info)
+        name_search = self.resolver.images_by_name(identifier)
         if len(name_search) > 0:
             if len(name_search) > 1:
-                tmp_image = dict((x['Id'], x['RepoTags']) for x in image_info)
                 repo_tags = []
                 for name in name_search:
-                    for repo_tag in tmp_image.get(name['Id']):
+                    for repo_tag in name['RepoTags']:
                         if repo_tag.find(identifier) > -1:
                             repo_tags.append(repo_tag)
                 raise ValueError("Found more than one image possibly "
@@ -1067,6 +1139,17 @@ class Atomic(object):
 
         raise DockerObjectNotFound(identifier)
 
+    @property
+    def resolver(self):
+        '''
+        Index of the images and containers used to resolve identifiers,
+        built once per invocation.  Images and containers are only listed
+        by the first lookup that needs them.
+        '''
+        if self._resolver is None:
+            self._resolver = ObjectResolver(self.get_images, self.get_containers)
+        return self._resolver
+
     def _get_docker_images(self, get_all=False):
         try:
             images = self.d.images(all=get_all)
@@ -1079,35 +1162,27 @@ class Atomic(object):
     def get_images(self, get_all=False):
         '''
         Wrapper function that should be used instead of querying docker
-        multiple times for a list of images.
+        multiple times for a list of images.  Docker metadata is cached
+        by AtomicDocker.
         '''
-        if get_all:
-            if len(self.images_all_cache) == 0:
-                self.images_all_cache = self._get_docker_images(get_all=True) + self.syscontainers.get_system_images(get_all=True)
-            return self.images_all_cache
-        else:
-            if len(self.images_cache) == 0:
-                self.images_cache = self._get_docker_images() + self.syscontainers.get_system_images()
-            return self.images_cache
+        return self._get_docker_images(get_all=get_all) + self.syscontainers.get_system_images(get_all=get_all)
 
     def get_containers(self):
         '''
         Wrapper function that should be used instead of querying docker
         multiple times for a list of containers
         '''
-        if not self.containers:
-            self.containers = self.d.containers(all=True)
-
-        return self.containers + self.syscontainers.get_system_containers()
+        return self.d.containers(all=True) + self.syscontainers.get_system_containers()
 
     def get_active_containers(self, refresh=False):
         '''
         Wrapper function for obtaining active containers.  Should be used
-        instead of direct queries to docker
+        instead of direct queries to docker.  refresh bypasses the cached
+        metadata.
         '''
-        if len(self.active_containers) == 0 or refresh:
-            self.active_containers = self.d.containers(all=False)
-
+        if refresh:
+            invalidate_docker_cache()
+        self.active_containers = self.d.containers(all=False)
         return self.active_containers
 
     def set_debug(self):
@@ -1,6 +1,11 @@
 import docker
 from docker.utils import kwargs_from_env
+import atexit
+import os
 import sys
+import threading
+import time
+import types
 import requests
 
 def get_docker_client():
@@ -13,6 +18,178 @@ def get_docker_client():
     except docker.errors.DockerException:
         return docker.Client(**kwargs_from_env())
 
+# The environment variables selecting the daemon, see kwargs_from_env()
+DOCKER_ENV_KEYS = ['DOCKER_HOST', 'DOCKER_TLS_VERIFY', 'DOCKER_CERT_PATH']
+
+def _daemon_key():
+    return tuple(os.environ.get(k) for k in DOCKER_ENV_KEYS)
+
+def get_shared_docker_client():
+    """
+    Returns the process-wide client for the daemon selected by the
+    environment.  The client is created, and its API version negotiated,
+    on first use; later callers reuse it together with its pool of HTTP
+    connections.  Safe to call from multiple threads.
+    """
+    key = _daemon_key()
+    pool = get_shared_docker_client
+    with pool.lock:
+        client = pool.clients.get(key)
+        if client is None:
+            client = get_docker_client()
+            pool.clients[key] = client
+            pool.stats['opened'] += 1
+        else:
+            pool.stats['reused'] += 1
+        return client
+get_shared_docker_client.lock = threading.Lock()
+get_shared_docker_client.clients = {}
+get_shared_docker_client.stats = {'opened': 0, 'reused': 0}
+
+def docker_client_stats():
+    """
+    Returns how many clients the pool opened and how many times one was
+    handed out again instead.
+    """
+    with get_shared_docker_client.lock:
+        return dict(get_shared_docker_client.stats)
+
+# Seconds a cached result stays valid, overridden by the docker_cache_ttl
+# item of atomic.conf.  It can be a number, applying to all the methods,
+# or a mapping from method name to seconds.  0 disables caching.
+DEFAULT_CACHE_TTL = {
+    'images': 10,
+    'containers': 2,
+    'info': 60,
+    'inspect_image': 10,
+    'inspect_container': 2,
+}
+
+# API methods that do not change anything on the daemon.  Calling any
+# other method through AtomicDocker invalidates the metadata cache.
+READ_ONLY_METHODS = set(DEFAULT_CACHE_TTL.keys()) | set([
+    'version', 'ping', 'search', 'top', 'history', 'get_image', 'login',
+    'logs', 'events', 'stats', 'diff', 'export', 'port', 'inspect_volume',
+    'volumes', 'networks', 'inspect_network', 'close'])
+
+
+def _copy_tree(tree):
+    # Cached results are JSON structures, so copying dicts and lists
+    # is enough to keep callers from modifying the cached copy.
+    if isinstance(tree, dict):
+        return dict((k, _copy_tree(v)) for k, v in tree.items())
+    if isinstance(tree, list):
+        return [_copy_tree(x) for x in tree]
+    return tree
+
+
+class MetadataCache(object):
+    """
+    Caches the results of the read-only queries made to one daemon.
+    Entries expire after a per-method TTL and the whole cache is dropped
+    whenever atomic changes something on the daemon.  Callers always get
+    their own copy of a cached result.
+    """
+    def __init__(self, ttls=None):
+        self.ttls = ttls if ttls is not None else self._configured_ttls()
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    @staticmethod
+    def _configured_ttls():
+        from . import util
+        ttls = dict(DEFAULT_CACHE_TTL)
+        try:
+            configured = util.get_atomic_config_item(['docker_cache_ttl'])
+        except (ValueError, TypeError):
+            configured = None
+        if isinstance(configured, dict):
+            ttls.update(configured)
+        elif isinstance(configured, (int, float)):
+            ttls = dict((k, configured) for k in ttls)
+        return ttls
+
+    def cacheable(self, method):
+        return self.ttls.get(method, 0) > 0
+
+    def call(self, method, func, *args, **kwargs):
+        key = (method, repr(args), repr(sorted(kwargs.items())))
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.stats['hits'] += 1
+                return _copy_tree(entry[1])
+            self.stats['misses'] += 1
+        result = func(*args, **kwargs)
+        with self.lock:
+            self.entries[key] = (now + self.ttls[method], _copy_tree(result))
+        return result
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.stats['invalidations'] += 1
+
+
+def _invalidate_after(stream, cache):
+    try:
+        for item in stream:
+            yield item
+    finally:
+        cache.invalidate()
+
+
+def get_docker_cache():
+    """
+    Returns the metadata cache of the daemon selected by the environment.
+    """
+    key = _daemon_key()
+    with get_docker_cache.lock:
+        cache = get_docker_cache.caches.get(key)
+        if cache is None:
+            cache = get_docker_cache.caches[key] = MetadataCache()
+        return cache
+get_docker_cache.lock = threading.Lock()
+get_docker_cache.caches = {}
+
+def invalidate_docker_cache():
+    """
+    Drops all the cached metadata.  To be called after changing the
+    daemon state without going through AtomicDocker, e.g. with the docker
+    CLI.
+    """
+    with get_docker_cache.lock:
+        caches = list(get_docker_cache.caches.values())
+    for cache in caches:
+        cache.invalidate()
+
+def docker_cache_stats():
+    """
+    Returns the metadata cache hits, misses and invalidations.
+    """
+    stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+    with get_docker_cache.lock:
+        caches = list(get_docker_cache.caches.values())
+    for cache in caches:
+        with cache.lock:
+            for k, v in cache.stats.items():
+                stats[k] += v
+    return stats
+
+@atexit.register
+def close_docker_clients():
+    """
+    Closes every pooled client.  The next get_shared_docker_client() call
+    opens a new one.
+    """
+    pool = get_shared_docker_client
+    with pool.lock:
+        for client in pool.clients.values():
+            client.close()
+        pool.clients.clear()
+
 def check_if_python2():
     if int(sys.version_info[0]) < 3:
         _input = raw_input # pylint: disable=undefined-variable,raw_input-builtin
@@ -22,13 +199,23 @@ def check_if_python2():
         return _input, False
 
 class AtomicDocker():
-    def __init__(self):
+    # Attributes resolved on AtomicDocker itself rather than on the client
+    OWN_ATTRIBUTES = ('_dockerclient', '_client', '_normalize', '_cache', 'close')
+
+    def __init__(self, normalize=True):
+        """
+        With normalize=False API results are returned exactly as the
+        daemon sent them, without removing the sha256: prefixes, and are
+        never cached.
+        """
         self._client = None
+        self._normalize = normalize
+        self._cache = get_docker_cache()
 
     @property
     def _dockerclient(self):
         if not self._client:
-            self._client = get_docker_client()
+            self._client = get_shared_docker_client()
         return self._client
 
     def __dir__(self):
@@ -47,16 +234,33 @@ class AtomicDocker():
         return self.__getattribute__(name)
 
     def __getattribute__(self, name):
-        # Avoid recursion for self._dockerclient
-        if name == "_dockerclient" or name == "_client":
+        # Avoid recursion for self._dockerclient, and keep close() from
+        # closing the shared client
+        if name in AtomicDocker.OWN_ATTRIBUTES:
             return object.__getattribute__(self, name)
         obj = self._dockerclient
         attr = docker.AutoVersionClient.__getattribute__(obj, name)
         if hasattr(attr, '__call__'):
+            normalize = NORMALIZERS.get(name, iter_subs) if self._normalize else None
+            cache = self._cache
+            def call(*args, **kwargs):
+                result = attr(*args, **kwargs)
+                return normalize(result) if normalize else result
             def newfunc(*args, **kwargs):
                 try:
-                    result = attr(*args, **kwargs)
-                    return iter_subs(result)
+                    if normalize and cache.cacheable(name):
+                        return cache.call(name, call, *args, **kwargs)
+                    if name in READ_ONLY_METHODS:
+                        return call(*args, **kwargs)
+                    try:
+                        result = call(*args, **kwargs)
+                    finally:
+                        cache.invalidate()
+                    if isinstance(result, types.GeneratorType):
+                        # e.g. pull(stream=True), the change is only
+                        # complete once the stream is consumed
+                        return _invalidate_after(result, cache)
+                    return result
                 except requests.exceptions.ConnectionError as e:
                     if name == "containers" or name == "images":
                         return []
@@ -66,8 +270,9 @@ class AtomicDocker():
             return attr
 
     def close(self):
-        if self._client != None:
-            self._client.close()
+        # The client is shared by the whole process, only drop our
+        # reference to it; close_docker_clients() closes the connections.
+        self._client = None
 
 is_python2 = check_if_python2()[1]
 
@@ -110,3 +315,92 @@ def iter_subs(tree, key=None):
         for i in range(len(tree)):
             tree[i] = iter_subs(tree[i])
     return tree
+
+
+if is_python2:
+    string_types = (str, unicode) # pylint: disable=undefined-variable,unicode-builtin
+else:
+    string_types = (str,)
+
+
+def _strip_algo(container, key):
+    value = container[key]
+    if isinstance(value, string_types) and value.startswith(ALGO):
+        container[key] = value[len(ALGO):]
+
+
+def _strip_path(tree, path):
+    """
+    Removes the algo from the value found under path, a tuple of keys, in
+    the dict tree.  When the value is a list, each entry is stripped.
+    """
+    for key in path[:-1]:
+        tree = tree.get(key)
+        if not isinstance(tree, dict):
+            return
+    key = path[-1]
+    value = tree.get(key)
+    if isinstance(value, list):
+        for i in range(len(value)):
+            _strip_algo(value, i)
+    elif value is not None:
+        _strip_algo(tree, key)
+
+
+def path_normalizer(*paths):
+    """
+    Returns a function normalizing an API result in place by stripping
+    the algo only from the values found under the given key paths.  Unlike
+    iter_subs it never looks at the rest of the result, so large nested
+    blobs like Config or GraphDriver are not walked.  The result can be a
+    dict, a list of dicts or a list of IDs (e.g. images(quiet=True)).
+    """
+    paths = [tuple(p.split('.')) for p in paths]
+    def normalize(result):
+        if isinstance(result, dict):
+            for path in paths:
+                _strip_path(result, path)
+        elif isinstance(result, list) and result and not isinstance(result[0], dict):
+            # A list of IDs
+            skip = len(ALGO)
+            result[:] = [x[skip:] if isinstance(x, string_types) and x.startswith(ALGO) else x
+                         for x in result]
+        elif isinstance(result, list):
+            for i, item in enumerate(result):
+                if isinstance(item, dict):
+                    for path in paths:
+                        _strip_path(item, path)
+                else:
+                    _strip_algo(result, i)
+        return result
+    return normalize
+
+
+def pass_through(result):
+    return result
+
+
+# How the result of each API method is normalized.  Methods not listed
+# here fall back to iter_subs.
+NORMALIZERS = {
+    'images': path_normalizer('Id'),
+    'containers': path_normalizer('Id', 'Image', 'ImageID'),
+    'inspect_image': path_normalizer('Id', 'Parent', 'Config.Image',
+                                     'ContainerConfig.Image', 'RootFS.Layers'),
+    'inspect_container': path_normalizer('Id', 'Image', 'Config.Image'),
+    'history': path_normalizer('Id'),
+    'commit': path_normalizer('Id'),
+    'create_container': path_normalizer('Id'),
+    'info': pass_through,
+    'version': pass_through,
+    'ping': pass_through,
+    'search': pass_through,
+    'top': pass_through,
+    'pull': pass_through,
+    'push': pass_through,
+    'login': pass_through,
+    'get_image': pass_through,
+    'remove_image': pass_through,
+    'remove_container': pass_through,
+    'stop': pass_through,
+}
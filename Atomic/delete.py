@@ -1,5 +1,6 @@
 from . import Atomic
 from . import util
+from .atomic import convert_size
 from docker.errors import NotFound
 from docker.errors import APIError
 import sys
@@ -33,7 +34,15 @@ class Delete(Atomic):
         Remove dangling images from registry
         :return: 0 if all images deleted or no dangling images found
         """
-        self.syscontainers.prune_ostree_images()
+        if self.args.dry_run:
+            return self._prune_images_dry_run()
+
+        freed = self.syscontainers.prune_ostree_images(timeout=self.args.timeout)
+        if freed is None:
+            util.write_out("Stopped deleting OSTree objects after {} seconds, "
+                           "run prune again to continue".format(self.args.timeout))
+        elif freed:
+            util.write_out("Freed {} of OSTree objects".format(convert_size(freed)))
 
         results = self.d.images(filters={"dangling":True}, quiet=True)
         if len(results) == 0:
@@ -44,6 +53,18 @@ class Delete(Atomic):
             util.write_out("Removed dangling Image {}".format(img))
         return 0
 
+    def _prune_images_dry_run(self):
+        total = 0
+        for name, size in self.syscontainers.get_ostree_reclaimable_space():
+            util.write_out("Would delete {} ({})".format(name, convert_size(size)))
+            total += size
+        if total:
+            util.write_out("Would free {} of OSTree objects".format(convert_size(total)))
+
+        for img in self.d.images(filters={"dangling":True}, quiet=True):
+            util.write_out("Would remove dangling Image {}".format(img))
+        return 0
+
     def _delete_remote(self, targets):
         results = 0
         for target in targets:
@@ -24,14 +24,14 @@ from . import Atomic
 import os
 import sys
 import json
-from fnmatch import fnmatch as matches
 import time
 import docker
 from . import util
 import requests
 from .util import NoDockerDaemon
 import shutil
-from .syscontainers import OSTREE_PRESENT as OSTREE_PRESENT
+from .syscontainers import load_ostree
+from .resolver import ImageIndex, ContainerIndex
 
 # Module for mounting and unmounting containerized applications.
 
@@ -301,14 +301,8 @@ class DockerMount(Mount):
         If identifier is an image UUID or image tag, create a temporary
         container and return its uuid.
         """
-        def __cname_matches(container, identifier):
-            return any([n for n in (container['Names'] or [])
-                        if matches(n, '/' + identifier)])
-
         # Determine if identifier is a container
-        containers = [c['Id'] for c in self.d.containers(all=True)
-                      if (__cname_matches(c, identifier) or
-                          matches(c['Id'], identifier + '*'))]
+        containers = [c['Id'] for c in ContainerIndex(self.d.containers(all=True)).containers_by_glob(identifier)]
 
         if len(containers) > 1:
             raise SelectionMatchError(identifier, containers)
@@ -317,16 +311,16 @@ class DockerMount(Mount):
             return c if self.live else self._clone(c)
 
         # Determine if identifier is an image UUID
-        images = [i for i in set(self.d.images(all=True, quiet=True))
-                  if i.startswith(identifier)]
+        images = [i['Id'] for i in ImageIndex(self.d.images(all=True)).images_by_id(identifier)]
 
         if len(images) > 1:
             raise SelectionMatchError(identifier, images)
         elif len(images) == 1:
             return self._create_temp_container(images[0])
 
-        # Match image tag.
-        images = util.image_by_name(identifier)
+        # Match image tag.  Intermediate layers have no name, only the
+        # default listing is matched.
+        images = ImageIndex(self.d.images()).images_by_name(identifier)
         if len(images) > 1:
             tags = [t for i in images for t in i['RepoTags']]
             raise SelectionMatchError(identifier, tags)
@@ -696,7 +690,7 @@ class OSTreeMount(Mount):
             options = []
         setxattr, _, _ = getxattrfuncs()
 
-        if not OSTREE_PRESENT:
+        if not load_ostree():
             return False
 
         options = ['remount', 'ro', 'nosuid', 'nodev']
@@ -737,7 +731,7 @@ class OSTreeMount(Mount):
         _, getxattr, removexattr = getxattrfuncs()
         typ = None
 
-        if not OSTREE_PRESENT:
+        if not load_ostree():
             return False
 
         if not self.mountpoint:
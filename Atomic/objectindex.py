@@ -0,0 +1,168 @@
+"""
+In-memory index of the images and containers of the host, for long
+running processes such as the D-Bus service.
+
+The index holds views, payloads built by a function, and only builds a
+view again once one of the sources it depends on changed.  Sources are
+kept current from the Docker events stream and from file monitors on the
+OSTree refs, the system containers checkouts and the scan results.  The
+runc state directory is not watched, as runc does not touch it when a
+container exits: the state of the system containers is never cached.
+File monitors are delivered by the GLib main loop.
+"""
+import os
+import threading
+import time
+
+from .client import AtomicDocker, invalidate_docker_cache
+from .syscontainers import invalidate_ostree_refs
+
+# Sources a view can depend on
+DOCKER = "docker"
+OSTREE = "ostree"
+CHECKOUTS = "checkouts"
+SCAN = "scan"
+
+# Docker events that do not change anything the index reports
+IGNORED_EVENTS = ('exec_create', 'exec_start', 'exec_die', 'exec_detach',
+                  'top', 'attach', 'resize', 'export')
+
+
+class ObjectIndex(object):
+
+    def __init__(self):
+        self.build_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.generation = 0
+        # Generation of the last change of each source
+        self.changed = {}
+        # Sources that are not currently watched, views depending on them
+        # are built on every call
+        self.unwatched = set()
+        self.views = {}
+        self.monitors = []
+        self.stats = {'hits': 0, 'builds': 0}
+
+    def add_view(self, name, build, sources):
+        self.views[name] = {"build": build, "sources": sources,
+                            "built": None, "payload": None}
+
+    def mark_dirty(self, source):
+        with self.lock:
+            self.generation += 1
+            self.changed[source] = self.generation
+        if source == DOCKER:
+            invalidate_docker_cache()
+        elif source == OSTREE:
+            invalidate_ostree_refs()
+
+    def _is_stale(self, view):
+        if view["built"] is None:
+            return True
+        for source in view["sources"]:
+            if source in self.unwatched or self.changed.get(source, 0) > view["built"]:
+                return True
+        return False
+
+    def get(self, name):
+        """
+        Returns the payload of the view name, building it if one of its
+        sources changed since it was last built.
+        """
+        view = self.views[name]
+        with self.build_lock:
+            with self.lock:
+                generation = self.generation
+                stale = self._is_stale(view)
+            if not stale:
+                self.stats['hits'] += 1
+                return view["payload"]
+            payload = view["build"]()
+            # A change noticed while building bumps the generation past
+            # the one recorded here, so the view is built again next time
+            view["payload"], view["built"] = payload, generation
+            self.stats['builds'] += 1
+            return payload
+
+    def warm_up(self):
+        """
+        Builds every view in a background thread.
+        """
+        def build_all():
+            for name in self.views:
+                try:
+                    self.get(name)
+                except Exception: # pylint: disable=broad-except
+                    pass
+        t = threading.Thread(target=build_all)
+        t.daemon = True
+        t.start()
+
+    def watch_path(self, path, source, directory=True):
+        """
+        Marks source as changed whenever path, a directory or a file,
+        changes.  If path cannot be monitored, the views depending on
+        source are built on every call instead.
+        """
+        from gi.repository import Gio, GLib # pylint: disable=no-name-in-module
+        try:
+            gfile = Gio.File.new_for_path(path)
+            if directory:
+                monitor = gfile.monitor_directory(Gio.FileMonitorFlags.NONE, None)
+            else:
+                monitor = gfile.monitor_file(Gio.FileMonitorFlags.NONE, None)
+        except GLib.Error:
+            with self.lock:
+                self.unwatched.add(source)
+            return
+        monitor.connect("changed", lambda *args: self.mark_dirty(source))
+        self.monitors.append(monitor)
+
+    def watch_docker_events(self):
+        """
+        Follows the Docker events stream in a background thread,
+        reconnecting when the stream breaks.
+        """
+        t = threading.Thread(target=self._follow_docker_events)
+        t.daemon = True
+        t.start()
+
+    def _follow_docker_events(self):
+        since = None
+        delay = 1
+        while True:
+            with self.lock:
+                self.unwatched.add(DOCKER)
+            try:
+                connected = int(time.time())
+                events = AtomicDocker().events(since=since, decode=True)
+                # Events missed while disconnected are replayed by the
+                # daemon from since on
+                with self.lock:
+                    self.unwatched.discard(DOCKER)
+                since = since or connected
+                delay = 1
+                for event in events:
+                    since = event.get("time", since)
+                    status = event.get("status", event.get("Action", "")) or ""
+                    if status.split(":")[0] in IGNORED_EVENTS:
+                        continue
+                    if event.get("Type", "container") in ("container", "image"):
+                        self.mark_dirty(DOCKER)
+            except Exception: # pylint: disable=broad-except
+                pass
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    def watch_host(self, atomic):
+        """
+        Sets up the monitors for the default locations used by atomic.
+        """
+        # pylint: disable=protected-access
+        syscontainers = atomic.syscontainers
+        refs = os.path.join(syscontainers._get_ostree_repo_location(), "refs", "heads")
+        self.watch_path(refs, OSTREE)
+        self.watch_path(os.path.join(refs, "ociimage"), OSTREE)
+        self.watch_path(syscontainers._get_system_checkout_path(), CHECKOUTS)
+        self.watch_path(os.path.join(atomic.results, "scan_summary.json"), SCAN, directory=False)
+        self.watch_docker_events()
@@ -6,21 +6,22 @@ import datetime
 from dateutil.parser import parse as dateparse
 
 class Ps(Atomic):
+    # How many containers are inspected concurrently
+    INSPECT_WORKERS = 8
 
     def ps_tty(self):
         skull = (u"\u2620").encode('utf-8')
-        all_container_info = self.ps()
+        all_container_info = self.ps(inspect=False)
         all_containers = []
         for each in all_container_info:
             if each["Type"] == "systemcontainer":
                 container = each["Id"]
-                status = "exited"
+                status = each["State"]
                 created = datetime.datetime.fromtimestamp(each["Created"])
+                # Served from the runtime states already fetched by ps()
                 info = self.syscontainers.get_container_runtime_info(container)
-                if 'status' in info:
-                    status = info["status"]
-                    if 'created' in info:
-                        created = info['created']
+                if 'created' in info:
+                    created = info['created']
 
                 if not self.args.all and status != "running":
                     continue
@@ -41,11 +42,18 @@ class Ps(Atomic):
             elif each["Type"] == "docker":
             # Collect the docker containers
                 container = each["Id"]
-                ret = self._inspect_container(name=container)
-                status = ret["State"]["Status"]
-                image = ret['Config']['Image']
-                command = u' '.join(ret['Config']['Cmd']) if ret['Config']['Cmd'] else ""
-                created = dateparse(ret['Created']).strftime("%F %H:%M") # pylint: disable=no-member
+                if isinstance(each["State"], dict):
+                    # Inspect payload
+                    status = each["State"]["Status"]
+                    image = each['Config']['Image']
+                    command = u' '.join(each['Config']['Cmd']) if each['Config']['Cmd'] else ""
+                    created = dateparse(each['Created']).strftime("%F %H:%M") # pylint: disable=no-member
+                else:
+                    # Entry of the containers list
+                    status = each["State"]
+                    image = each["Image"]
+                    command = each["Command"] or ""
+                    created = datetime.datetime.utcfromtimestamp(each["Created"]).strftime("%F %H:%M")
                 container_info = {"type" : "docker", "container" : container,
                                   "image" : image, "command" : command,
                                   "created" : created, "status" : status,
@@ -103,13 +111,21 @@ class Ps(Atomic):
                                           container["created"][0:16],
                                           container["status"][0:9],
                                           container["runtime"][0:10]))
-    def ps(self):
+    def ps(self, inspect=True):
+        """
+        Returns the system containers and the Docker containers.  With
+        inspect=False, Docker containers are described by their entry in
+        the containers list instead of their inspect payload, which saves
+        a query per container; only containers whose entry lacks the
+        State (older daemons) are still inspected.
+        """
         all_containers = []
         vuln_ids = self.get_vulnerable_ids()
         all_vuln_info = json.loads(self.get_all_vulnerable_info())
 
         # Collect the system containers
         for i in self.syscontainers.get_system_containers():
+            i["State"] = self.syscontainers.get_container_runtime_info(i['Id']).get("status", "exited")
             i["vulnerable"] = i['Id'] in vuln_ids
             if i["vulnerable"]:
                 i["vuln_info"] = all_vuln_info[i['Id']]
@@ -118,18 +134,41 @@ class Ps(Atomic):
             all_containers.append(i)
 
         # Collect the docker containers
-        for container in [x["Id"] for x in self.d.containers(all=self.args.all)]:
-            ret = self._inspect_container(name=container)
+        containers = self.d.containers(all=self.args.all)
+        to_inspect = [i for i, x in enumerate(containers) if inspect or "State" not in x]
+        inspected = util.parallel_map(lambda i: self._inspect_container(name=containers[i]["Id"]),
+                                      to_inspect, workers=self.INSPECT_WORKERS)
+        for i, ret in zip(to_inspect, inspected):
+            containers[i] = ret
+
+        # Containers removed since they were listed cannot be inspected
+        for ret in [x for x in containers if x is not None]:
+            image_id = ret.get("ImageID", ret["Image"])
             ret["Type"] = "docker"
-            ret["vulnerable"] = ret["Image"] in vuln_ids
+            ret["vulnerable"] = image_id in vuln_ids
             if ret["vulnerable"]:
-                ret["vuln_info"] = all_vuln_info[ret["ImageId"]]
+                ret["vuln_info"] = all_vuln_info[image_id]
             else:
                 ret["vuln_info"] = dict()
             all_containers.append(ret)
 
         return all_containers
 
+    def update_runtime_states(self, containers):
+        """
+        Returns a copy of containers, a list returned by ps(), with the
+        state of the system containers read again from runc.  runc does
+        not touch its state directory when a container exits, so a cached
+        list cannot tell whether they are still running.
+        """
+        ret = []
+        for i in containers:
+            if i.get("Type") == "systemcontainer":
+                i = dict(i)
+                i["State"] = self.syscontainers.get_container_runtime_info(i['Id']).get("status", "exited")
+            ret.append(i)
+        return ret
+
     def _filter_include_container(self, container_info):
         filterables = ["container", "image", "command", "created", "status", "runtime"]
         for j in self.args.filter:
@@ -0,0 +1,184 @@
+"""
+Resolution of the identifiers given on the command line (IDs, short IDs,
+container names and [reg/]repo[:tag] image names, possibly with globs) to
+images and containers.  The index is built once from the images and
+containers listings, Docker and OSTree alike, and answers every query by
+bisection instead of scanning the listings again.
+"""
+import bisect
+
+from .util import decompose, glob_matcher, images_by_names, NameMatcher
+
+GLOB_CHARS = '*?['
+
+
+def literal_prefix(pattern):
+    """
+    Returns the part of a glob pattern before its first special character.
+    """
+    for i, c in enumerate(pattern):
+        if c in GLOB_CHARS:
+            return pattern[:i]
+    return pattern
+
+
+class PrefixIndex(object):
+    """
+    Sorted (key, value) pairs answering exact, prefix and glob lookups.
+    """
+    def __init__(self, pairs):
+        pairs = sorted(pairs, key=lambda x: x[0])
+        self.keys = [k for k, _ in pairs]
+        self.values = [v for _, v in pairs]
+
+    def _range(self, prefix):
+        start = bisect.bisect_left(self.keys, prefix)
+        end = start
+        while end < len(self.keys) and self.keys[end].startswith(prefix):
+            end += 1
+        return start, end
+
+    def prefix(self, prefix):
+        start, end = self._range(prefix)
+        return self.values[start:end]
+
+    def exact(self, key):
+        start, end = self._range(key)
+        return [self.values[i] for i in range(start, end) if self.keys[i] == key]
+
+    def glob(self, pattern):
+        literal = literal_prefix(pattern)
+        if literal == pattern:
+            return self.exact(pattern)
+        # Only the keys sharing the literal prefix can match
+        start, end = self._range(literal)
+        match = glob_matcher(pattern)
+        return [self.values[i] for i in range(start, end) if match(self.keys[i])]
+
+
+class ImageIndex(object):
+    """
+    Index of images, a listing like the ones returned by
+    Atomic.get_images(); query results keep the listing order.
+    """
+    def __init__(self, images):
+        self.images = images
+        self.image_ids = PrefixIndex((i['Id'], n) for n, i in enumerate(images))
+
+        # Image names decomposed once, grouped by repository
+        by_repo = {}
+        for n, i in enumerate(images):
+            for t in i.get('RepoTags') or []:
+                reg, rep, tag = decompose(t)
+                by_repo.setdefault(rep, []).append((reg, tag, n))
+        self.repos = PrefixIndex(by_repo.items())
+        # Reversed repositories, so that suffix matches become prefix ones
+        self.reversed_repos = PrefixIndex((rep[::-1], n) for rep, entries in by_repo.items()
+                                          for _, _, n in entries)
+        # Names matched in advance by resolve_names()
+        self.names = {}
+
+    def _images(self, indexes):
+        return [self.images[n] for n in sorted(set(indexes))]
+
+    def images_by_id(self, prefix):
+        return self._images(self.image_ids.prefix(prefix))
+
+    def resolve_names(self, img_names):
+        """
+        Matches all of img_names in a single pass over the tags, for the
+        images_by_name() calls to come.
+        """
+        names = [n for n in img_names if n not in self.names]
+        if names:
+            self.names.update(images_by_names(names, images=self.images))
+
+    def images_by_name(self, img_name):
+        """
+        Same matching rules as util.image_by_name().
+        """
+        if img_name in self.names:
+            return list(self.names[img_name])
+        matcher = NameMatcher(img_name)
+        _, i_rep, _ = decompose(img_name)
+
+        found = []
+        for entries in self.repos.glob(i_rep):
+            found.extend(n for reg, tag, n in entries if matcher.reg(reg) and matcher.tag(tag))
+        # Some repo after decompose end up with the img_name
+        # at the end.  i.e. rhel7/rsyslog
+        found.extend(self.reversed_repos.prefix(img_name[::-1]))
+        return self._images(found)
+
+
+class ContainerIndex(object):
+    """
+    Index of containers, a listing like the ones returned by
+    Atomic.get_containers(); query results keep the listing order.
+    """
+    def __init__(self, containers):
+        self.containers = containers
+        self.container_ids = PrefixIndex((c['Id'], n) for n, c in enumerate(containers))
+        self.container_names = PrefixIndex((name, n) for n, c in enumerate(containers)
+                                           for name in c.get('Names') or [])
+
+    def _containers(self, indexes):
+        return [self.containers[n] for n in sorted(set(indexes))]
+
+    def containers_by_id(self, prefix):
+        return self._containers(self.container_ids.prefix(prefix))
+
+    def containers_by_name(self, prefix):
+        return self._containers(self.container_names.prefix(prefix))
+
+    def containers_by_glob(self, pattern):
+        """
+        Containers with a name matching /pattern, or an ID matching
+        pattern*.
+        """
+        return self._containers(self.container_names.glob('/' + pattern) +
+                                self.container_ids.glob(pattern + '*'))
+
+
+class ObjectResolver(object):
+    """
+    Lazily built ImageIndex and ContainerIndex.  get_images and
+    get_containers return the listings, they are only called by the first
+    query that needs them, so that resolving a container does not list the
+    images.
+    """
+    def __init__(self, get_images, get_containers):
+        self.get_images = get_images
+        self.get_containers = get_containers
+        self._image_index = None
+        self._container_index = None
+
+    @property
+    def image_index(self):
+        if self._image_index is None:
+            self._image_index = ImageIndex(self.get_images())
+        return self._image_index
+
+    @property
+    def container_index(self):
+        if self._container_index is None:
+            self._container_index = ContainerIndex(self.get_containers())
+        return self._container_index
+
+    def images_by_id(self, prefix):
+        return self.image_index.images_by_id(prefix)
+
+    def images_by_name(self, img_name):
+        return self.image_index.images_by_name(img_name)
+
+    def resolve_image_names(self, img_names):
+        self.image_index.resolve_names(img_names)
+
+    def containers_by_id(self, prefix):
+        return self.container_index.containers_by_id(prefix)
+
+    def containers_by_name(self, prefix):
+        return self.container_index.containers_by_name(prefix)
+
+    def containers_by_glob(self, pattern):
+        return self.container_index.containers_by_glob(pattern)
@@ -27,6 +27,7 @@ class Scan(Atomic):
         self.rootfs_mappings = {}
         self.scanner = None
         self.mount_paths = {}
+        self._mounter = None
 
     def get_scanners_list(self):
         return json.dumps(self.scanners)
@@ -199,11 +200,13 @@ class Scan(Atomic):
             if set(self.args.scan_targets) == set(all_names):
                 self.args.all = True
 
+            containers_by_id = dict((item['Id'], item) for item in reversed(containers))
+            images_by_id = dict((item['Id'], item) for item in reversed(images))
+            # Match the image names of all the targets in one pass
+            self.resolver.resolve_image_names(self.args.scan_targets)
             for scan_input in self.args.scan_targets:
-                docker_object = (next((item for item in containers
-                                       if item['Id'] == self.get_input_id(scan_input)), None))
-                docker_object = docker_object if docker_object is not None \
-                    else (next((item for item in images if item['Id'] == self.get_input_id(scan_input)), None))
+                input_id = self.get_input_id(scan_input)
+                docker_object = containers_by_id.get(input_id, images_by_id.get(input_id))
                 if docker_object is not None:
                     docker_object['input'] = scan_input
                     scan_list.append(docker_object)
@@ -437,17 +440,23 @@ class Scan(Atomic):
         util.write_out("\n* denotes defaults")
         sys.exit(0)
 
+    @property
+    def _mount(self):
+        # A single Mount helper serves every object scanned
+        if self._mounter is None:
+            self._mounter = mount.Mount()
+            self._mounter.set_args(self.args)
+        return self._mounter
+
     def mount(self, mountpoint, image):
-        m = mount.Mount()
-        m.set_args(self.args)
+        m = self._mount
         m.mountpoint = mountpoint
         m.image = image
         m.shared = True
         m.mount()
 
     def unmount(self, mountpoint):
-        m = mount.Mount()
-        m.set_args(self.args)
+        m = self._mount
         m.mountpoint = mountpoint
         m.unmount()
 
@@ -148,13 +148,13 @@ class Storage(Atomic):
 
     def Export(self):
         try:
-            export_docker(self.args.graph, self.args.export_location, self.force)
+            export_docker(self.args.graph or util.default_docker_lib(), self.args.export_location, self.force)
         except requests.exceptions.ConnectionError:
             raise NoDockerDaemon()
 
     def Import(self):
         self.ping()
         try:
-            import_docker(self.args.graph, self.args.import_location)
+            import_docker(self.args.graph or util.default_docker_lib(), self.args.import_location)
         except requests.exceptions.ConnectionError:
             raise NoDockerDaemon()
@@ -10,20 +10,45 @@ import shutil
 import stat
 import subprocess
 import time
+import threading
+import hashlib
+import multiprocessing
+import errno
+import fcntl
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue # pylint: disable=import-error
 from .client import AtomicDocker
+from docker.errors import APIError
 from ctypes import cdll, CDLL
 from dateutil.parser import parse as dateparse
 
-try:
-    import gi
-    try:
-        gi.require_version('OSTree', '1.0')
-        from gi.repository import Gio, GLib, OSTree  # pylint: disable=no-name-in-module
-        OSTREE_PRESENT = True
-    except ValueError:
-        OSTREE_PRESENT = False
-except ImportError:
-    OSTREE_PRESENT = False
+# The GObject introspection bindings are bound by load_ostree() the first
+# time a system container code path needs them.
+Gio = GLib = OSTree = None
+
+def load_ostree():
+    """
+    Import the OSTree bindings once per process.  Starting GObject
+    introspection is expensive, so commands that never look at system
+    containers must not pay for it.
+    :return: True if OSTree is available
+    """
+    global Gio, GLib, OSTree # pylint: disable=global-statement
+    with load_ostree.lock:
+        if load_ostree.present is None:
+            try:
+                import gi
+                gi.require_version('OSTree', '1.0')
+                from gi.repository import Gio as _Gio, GLib as _GLib, OSTree as _OSTree  # pylint: disable=no-name-in-module
+                Gio, GLib, OSTree = _Gio, _GLib, _OSTree
+                load_ostree.present = True
+            except (ImportError, ValueError):
+                load_ostree.present = False
+    return load_ostree.present
+load_ostree.lock = threading.Lock()
+load_ostree.present = None
 
 try:
     from subprocess import DEVNULL  # pylint: disable=no-name-in-module
@@ -33,6 +58,134 @@ except ImportError:
 ATOMIC_LIBEXEC = os.environ.get('ATOMIC_LIBEXEC', '/usr/libexec/atomic')
 
 OSTREE_OCIIMAGE_PREFIX = "ociimage/"
+# Branches of the flattened commits of images, by manifest digest
+OSTREE_FLATTENED_PREFIX = "ociflattened/"
+# Cache file of the digests of dockertar: layers
+DOCKERTAR_DIGESTS_CACHE = "dockertar-digests.json"
+# Cache file of the image records of the commits of an OSTree repository,
+# by repository location
+SYSTEM_IMAGES_CACHE = "system-images-%s.json"
+# Cache file of the system containers records, by checkout path
+SYSTEM_CONTAINERS_CACHE = "system-containers-%s.json"
+# Downloaded layers waiting to be imported into OSTree
+LAYERS_DOWNLOAD_AHEAD = 2
+# Lock file in the OSTree repository, see RepoLock
+ATOMIC_REPO_LOCK = ".atomic-lock"
+
+class OpenedRepo(object):
+    """
+    An opened OSTree repository and the per-process caches kept for it.
+    Commits are immutable, so cached commits stay valid; the refs listing
+    is dropped whenever refs are written.
+    """
+    def __init__(self, repo):
+        self.repo = repo
+        self.lock = threading.Lock()
+        self.refs = None
+        self.commits = {}
+
+# Opened repositories by location, see SystemContainers._get_ostree_repo()
+OSTREE_REPOS = {}
+OSTREE_REPOS_LOCK = threading.Lock()
+
+def _opened_repo(repo):
+    with OSTREE_REPOS_LOCK:
+        for opened in OSTREE_REPOS.values():
+            if opened.repo is repo:
+                return opened
+    return None
+
+def invalidate_ostree_refs(repo=None):
+    """
+    Drops the cached refs of repo, or of every opened repository.  To be
+    called after the refs were changed, including by another process.
+    """
+    with OSTREE_REPOS_LOCK:
+        opened = list(OSTREE_REPOS.values())
+    for i in opened:
+        if repo is None or i.repo is repo:
+            with i.lock:
+                i.refs = None
+class RepoLock(object):
+    """
+    flock(2) on a file of an OSTree repository.  Pulls hold it shared
+    while they write objects and refs, prune holds it exclusively, so that
+    it never deletes the objects or layer refs of an image whose branch is
+    not set yet.
+    """
+    def __init__(self, location, exclusive=False):
+        self.path = os.path.join(location, ATOMIC_REPO_LOCK)
+        self.exclusive = exclusive
+        self.fd = None
+
+    def acquire(self, blocking=True):
+        """
+        :return: False if blocking is False and another process holds the lock
+        """
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        operation = fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH
+        if not blocking:
+            operation |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(fd, operation)
+        except (IOError, OSError) as e:
+            os.close(fd)
+            if not blocking and e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return False
+            raise
+        self.fd = fd
+        return True
+
+    def release(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+class FifoWriter(object):
+    """
+    Copies fileobj into the FIFO at path from a thread, for the duration
+    of a with block, so that programs taking a file name can read data
+    that is not on disk.
+    """
+    def __init__(self, fileobj, path):
+        self.fileobj = fileobj
+        self.path = path
+        self.thread = threading.Thread(target=self._write)
+        self.thread.daemon = True
+
+    def _write(self):
+        try:
+            with open(self.path, 'wb') as f:
+                shutil.copyfileobj(self.fileobj, f, 1024 * 1024)
+        except (IOError, OSError):
+            # The reader went away before the end of the data
+            pass
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        while self.thread.is_alive():
+            # Open and close the read end, so that a writer still waiting
+            # for a reader gets an error instead of blocking forever
+            fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+            os.close(fd)
+            self.thread.join(0.1)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
 SYSTEMD_UNIT_FILES_DEST = "/etc/systemd/system"
 SYSTEMD_UNIT_FILES_DEST_USER = "%s/.config/systemd/user" # Must be expanded
 SYSTEMD_UNIT_FILE_DEFAULT_TEMPLATE = """
@@ -59,6 +212,7 @@ class SystemContainers(object):
         self.user = util.is_user_mode()
         self.args = None
         self.setvalues = None
+        self._runtime_states = None
 
     def get_atomic_config_item(self, config_item):
         return util.get_atomic_config_item(config_item, atomic_config=self.atomic_config)
@@ -78,38 +232,211 @@ class SystemContainers(object):
                         stderr=DEVNULL)
 
     def _checkout_layer(self, repo, rootfs_fd, rootfs, rev):
-        OSTREE_SAFE_GLIB_REPO_CHECKOUT_OPTIONS = False
-        # There is an issue in the way the RepoCheckoutOptions is mapped by glib, as the C
-        # struct is using bit fields that are not supported by the introspection.
-        # Accessing .disable_fsync and .process_whiteouts thus results in a segfault in
-        # libostree.  Re-enable this once it gets fixed.
-        if OSTREE_SAFE_GLIB_REPO_CHECKOUT_OPTIONS:
-            options = OSTree.RepoCheckoutOptions() # pylint: disable=no-member
+        # RepoCheckoutAtOptions, unlike RepoCheckoutOptions, has no bit
+        # fields, so it can be used through the introspection.  Check out
+        # in process when it is available, without forking ostree and
+        # opening the repository again for each layer.
+        if hasattr(OSTree, "RepoCheckoutAtOptions"):
+            options = OSTree.RepoCheckoutAtOptions() # pylint: disable=no-member
             options.overwrite_mode = OSTree.RepoCheckoutOverwriteMode.UNION_FILES
             options.process_whiteouts = True
-            options.disable_fsync = True
+            options.enable_fsync = False
             if self.user:
                 options.mode = OSTree.RepoCheckoutMode.USER
-            repo.checkout_tree_at(options, rootfs_fd, rootfs, rev)
+            try:
+                repo.checkout_at(options, rootfs_fd, rootfs, rev, None)
+                return
+            except GLib.Error: # pylint: disable=catching-non-exception
+                pass
+
+        if self.user:
+            user = ["--user-mode"]
         else:
-            if self.user:
-                user = ["--user-mode"]
-            else:
-                user = []
-            util.check_call(["ostree", "--repo=%s" % self._get_ostree_repo_location(),
-                             "checkout",
-                             "--union"] +
-                            user +
-                             ["--whiteouts",
-                              "--fsync=no",
-                              rev,
-                              rootfs],
+            user = []
+        util.check_call(["ostree", "--repo=%s" % self._get_ostree_repo_location(),
+                         "checkout",
+                         "--union"] +
+                        user +
+                        ["--whiteouts",
+                         "--fsync=no",
+                         rev,
+                         rootfs],
+                        stdin=DEVNULL,
+                        stdout=DEVNULL,
+                        stderr=DEVNULL)
+
+    def _link_previous_rootfs(self, repo, previous, layers, rootfs):
+        """
+        previous is the (rootfs, commit) of the deployment being updated.
+        If its layers are the first ones of layers, hard link its rootfs
+        into rootfs so that only the new layers are checked out on top.
+        Returns the number of layers already in rootfs.
+        """
+        previous_rootfs, previous_rev = previous
+        if not previous_rev or not os.path.isdir(previous_rootfs):
+            return 0
+        try:
+            manifest = self._image_manifest(repo, previous_rev)
+        except GLib.Error: # pylint: disable=catching-non-exception
+            # The commit of the previous image was pruned
+            return 0
+        if manifest is None:
+            return 0
+        previous_layers = SystemContainers.get_layers_from_manifest(json.loads(manifest))
+        if not previous_layers or layers[:len(previous_layers)] != previous_layers:
+            return 0
+
+        # The checkout replaces files instead of writing to them, so the
+        # hard links shared with the previous deployment are not modified
+        try:
+            util.check_call(["cp", "-al", os.path.join(previous_rootfs, "."), rootfs],
                             stdin=DEVNULL,
                             stdout=DEVNULL,
                             stderr=DEVNULL)
+        except subprocess.CalledProcessError:
+            shutil.rmtree(rootfs)
+            os.makedirs(rootfs)
+            return 0
+        util.write_out("Reusing %d of %d layers from %s" % (len(previous_layers), len(layers), previous_rootfs))
+        return len(previous_layers)
+
+    def _checkout_layers(self, repo, rootfs_fd, rootfs, layers):
+        for layer in layers:
+            rev_layer = self._resolve_ref(repo, "%s%s" % (OSTREE_OCIIMAGE_PREFIX, layer.replace("sha256:", "")), False)
+            self._checkout_layer(repo, rootfs_fd, rootfs, rev_layer)
+
+    @staticmethod
+    def _get_flattened_branch(manifest):
+        return "%s%s" % (OSTREE_FLATTENED_PREFIX, hashlib.sha256(manifest.encode('utf-8')).hexdigest())
+
+    def _get_flattened_commit(self, repo, manifest, layers):
+        """
+        Returns the commit with the layers of manifest already checked out
+        on top of each other, creating it the first time.  Returns None if
+        it cannot be created, the layers are then checked out one by one.
+        """
+        branch = SystemContainers._get_flattened_branch(manifest)
+        rev = self._resolve_ref(repo, branch)
+        if rev:
+            return rev
+
+        repo_location = self._get_ostree_repo_location()
+        # The checkout must be on the same file system as the repository,
+        # so that the commit reuses the objects it is hard linked to.
+        temp_dir = tempfile.mkdtemp(dir=os.path.join(repo_location, "tmp"))
+        lock = RepoLock(repo_location)
+        lock.acquire()
+        try:
+            tree = os.path.join(temp_dir, "rootfs")
+            os.mkdir(tree)
+            tree_fd = os.open(tree, os.O_DIRECTORY)
+            try:
+                self._checkout_layers(repo, tree_fd, tree, layers)
+            finally:
+                os.close(tree_fd)
+            util.check_call(["ostree", "--repo=%s" % repo_location, "commit",
+                             "--link-checkout-speedup",
+                             "--branch=%s" % branch,
+                             "--tree=dir=%s" % tree],
+                            stdin=DEVNULL,
+                            stdout=DEVNULL,
+                            stderr=DEVNULL)
+        except (subprocess.CalledProcessError, OSError, util.FileNotFound, GLib.Error): # pylint: disable=catching-non-exception
+            return None
+        finally:
+            lock.release()
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            invalidate_ostree_refs(repo)
+        return self._resolve_ref(repo, branch)
+
+    def _get_flattened_branches_in_use(self, repo, revs):
+        in_use = set()
+        for rev in revs:
+            manifest = self._image_manifest(repo, rev)
+            if manifest:
+                in_use.add(SystemContainers._get_flattened_branch(manifest))
+        return in_use
+
+    def _get_deployed_infos(self):
+        """
+        Returns the info of every deployment of the system containers: the
+        running ones and the ones kept for rollback.
+        """
+        checkouts = self._get_system_checkout_path()
+        if not os.path.exists(checkouts):
+            return []
+        deployments = set()
+        for x in os.listdir(checkouts):
+            fullpath = os.path.join(checkouts, x)
+            if not os.path.islink(fullpath):
+                continue
+            current = os.path.realpath(fullpath)
+            deployments.add(current)
+            if current.endswith(".0") or current.endswith(".1"):
+                deployments.update([current[:-2] + ".0", current[:-2] + ".1"])
+
+        infos = []
+        for deployment in deployments:
+            try:
+                with open(os.path.join(deployment, "info"), "r") as info_file:
+                    infos.append(json.load(info_file))
+            except (IOError, OSError, ValueError):
+                pass
+        return infos
+
+    def _get_reachable_refs(self, repo):
+        """
+        Returns the layer and flattened refs still needed by an image
+        branch or by a deployment of a system container.
+        """
+        refs = self._list_refs(repo)
+        roots = set(refs[x] for x in refs if x.startswith(OSTREE_OCIIMAGE_PREFIX) \
+                    and len(x) != len(OSTREE_OCIIMAGE_PREFIX) + 64)
+        layers = set()
+        for info in self._get_commit_infos(repo, list(roots)).values():
+            layers.update(info['Layers'] or [])
+
+        for deployed in self._get_deployed_infos():
+            layers.update(deployed.get("layers") or [])
+            rev = deployed.get("ostree-commit")
+            if not rev or rev in roots:
+                continue
+            try:
+                info = self._get_commit_info(repo, rev)
+            except GLib.Error: # pylint: disable=catching-non-exception
+                # The image was deleted and its commit already pruned
+                continue
+            roots.add(rev)
+            layers.update(info['Layers'] or [])
+
+        reachable = set(OSTREE_OCIIMAGE_PREFIX + x.replace("sha256:", "") for x in layers)
+        reachable.update(self._get_flattened_branches_in_use(repo, roots))
+        return reachable
+
+    def _get_unreachable_refs(self, repo):
+        reachable = self._get_reachable_refs(repo)
+        unreachable = []
+        for i in sorted(self._list_refs(repo)):
+            if i in reachable:
+                continue
+            if (i.startswith(OSTREE_OCIIMAGE_PREFIX) and len(i) == len(OSTREE_OCIIMAGE_PREFIX) + 64) \
+               or i.startswith(OSTREE_FLATTENED_PREFIX):
+                unreachable.append(i)
+        return unreachable
+
+    @staticmethod
+    def _delete_refs(repo, refs):
+        for i in refs:
+            ref = OSTree.parse_refspec(i)
+            repo.set_ref_immediate(ref[1], ref[2], None)
+        invalidate_ostree_refs(repo)
+
+    def _prune_flattened_commits(self, repo):
+        self._delete_refs(repo, [x for x in self._get_unreachable_refs(repo) if x.startswith(OSTREE_FLATTENED_PREFIX)])
 
     def set_args(self, args):
         self.args = args
+        self._runtime_states = None
 
         try:
             self.backend = args.backend
@@ -124,14 +451,20 @@ class SystemContainers(object):
             pass
 
     def _pull_image_to_ostree(self, repo, image, upgrade):
-        if image.startswith("ostree:"):
-            self._check_system_ostree_image(repo, image, upgrade)
-        elif self.args.image.startswith("docker:"):
-            self._pull_docker_image(repo, image.replace("docker:", ""))
-        elif self.args.image.startswith("dockertar:"):
-            self._pull_docker_tar(repo, image.replace("dockertar:", ""))
-        else: # Assume "oci:"
-            self._check_system_oci_image(repo, image, upgrade)
+        lock = RepoLock(repo.get_path().get_path())
+        lock.acquire()
+        try:
+            if image.startswith("ostree:"):
+                self._check_system_ostree_image(repo, image, upgrade)
+            elif self.args.image.startswith("docker:"):
+                self._pull_docker_image(repo, image.replace("docker:", ""))
+            elif self.args.image.startswith("dockertar:"):
+                self._pull_docker_tar(repo, image.replace("dockertar:", ""))
+            else: # Assume "oci:"
+                self._check_system_oci_image(repo, image, upgrade)
+        finally:
+            lock.release()
+            invalidate_ostree_refs(repo)
 
     def pull_image(self):
         if self.backend == "ostree":
@@ -206,7 +539,7 @@ class SystemContainers(object):
             runc_commands = ["run", "kill"]
         return ["%s %s '%s'" % (RUNC_PATH, command, name) for command in runc_commands]
 
-    def _checkout_system_container(self, repo, name, img, deployment, upgrade, values=None, destination=None, extract_only=False):
+    def _checkout_system_container(self, repo, name, img, deployment, upgrade, values=None, destination=None, extract_only=False, previous=None):
         if not values:
             values = {}
         imagebranch = SystemContainers._get_ostree_image_branch(img)
@@ -214,11 +547,7 @@ class SystemContainers(object):
         destination = destination or "%s/%s.%d" % (self._get_system_checkout_path(), name, deployment)
         exports = os.path.join(destination, "rootfs/exports")
         unitfile = os.path.join(exports, "service.template")
-        if self.user:
-            home = os.path.expanduser("~")
-            unitfileout = os.path.join(SYSTEMD_UNIT_FILES_DEST_USER % home, "%s.service" % name)
-        else:
-            unitfileout = os.path.join(SYSTEMD_UNIT_FILES_DEST, "%s.service" % name)
+        unitfileout = self._get_unit_file_path(name)
 
         if not upgrade and os.path.exists(unitfileout):
             raise ValueError("The file %s already exists." % unitfileout)
@@ -249,19 +578,30 @@ class SystemContainers(object):
 
         os.makedirs(rootfs)
 
-        rev = repo.resolve_rev(imagebranch, False)[1]
+        rev = self._resolve_ref(repo, imagebranch, False)
         manifest = self._image_manifest(repo, rev)
+        layers = None
+        reused = 0
+        if manifest is not None:
+            layers = SystemContainers.get_layers_from_manifest(json.loads(manifest))
+            if previous:
+                reused = self._link_previous_rootfs(repo, previous, layers, rootfs)
 
         rootfs_fd = None
         try:
             rootfs_fd = os.open(rootfs, os.O_DIRECTORY)
             if manifest is None:
                 self._checkout_layer(repo, rootfs_fd, rootfs, rev)
+            elif reused:
+                self._checkout_layers(repo, rootfs_fd, rootfs, layers[reused:])
             else:
-                layers = SystemContainers.get_layers_from_manifest(json.loads(manifest))
-                for layer in layers:
-                    rev_layer = repo.resolve_rev("%s%s" % (OSTREE_OCIIMAGE_PREFIX, layer.replace("sha256:", "")), False)[1]
-                    self._checkout_layer(repo, rootfs_fd, rootfs, rev_layer)
+                flattened = None
+                if self.get_atomic_config_item(["flatten_images"]):
+                    flattened = self._get_flattened_commit(repo, manifest, layers)
+                if flattened:
+                    self._checkout_layer(repo, rootfs_fd, rootfs, flattened)
+                else:
+                    self._checkout_layers(repo, rootfs_fd, rootfs, layers)
             self._do_syncfs(rootfs, rootfs_fd)
         finally:
             if rootfs_fd:
@@ -296,23 +636,13 @@ class SystemContainers(object):
         values["NAME"] = name
         values["EXEC_START"], values["EXEC_STOP"] = self._generate_systemd_startstop_directives(name)
 
-        def _write_template(inputfilename, data, values, outfile):
-            template = Template(data)
-            result = template.safe_substitute(values)
-            if '$' in result.replace("$$", ""):
-                missing = {x[1] for x in template.pattern.findall(data, template.flags) if len(x[1]) > 0 and x[1] not in values} # pylint: disable=no-member
-                raise ValueError("The template file %s still contains unreplaced values for: %s" % \
-                                 (inputfilename, ", ".join(missing)))
-
-            outfile.write(result)
-
         src = os.path.join(exports, "config.json")
         destination_path = os.path.join(destination, "config.json")
         if os.path.exists(src):
             shutil.copyfile(src, destination_path)
         elif os.path.exists(src + ".template"):
             with open(src + ".template", 'r') as infile, open(destination_path, "w") as outfile:
-                _write_template(src + ".template", infile.read(), values, outfile)
+                SystemContainers._write_template(src + ".template", infile.read(), values, outfile)
         else:
             self._generate_default_oci_configuration(destination)
 
@@ -329,10 +659,40 @@ class SystemContainers(object):
             info = {"image" : img,
                     "revision" : image_id,
                     "ostree-commit": rev,
+                    "layers" : layers,
                     'created' : calendar.timegm(time.gmtime()),
                     "values" : values}
             info_file.write(json.dumps(info, indent=4))
 
+        self._write_unit_file(unitfile, unitfileout, values)
+
+        self._set_deployment(name, destination)
+
+        self._systemctl_command("enable", name)
+        if upgrade:
+            self._systemctl_command("restart", name)
+        else:
+            self._systemctl_command("start", name)
+        return
+
+    @staticmethod
+    def _write_template(inputfilename, data, values, outfile):
+        template = Template(data)
+        result = template.safe_substitute(values)
+        if '$' in result.replace("$$", ""):
+            missing = {x[1] for x in template.pattern.findall(data, template.flags) if len(x[1]) > 0 and x[1] not in values} # pylint: disable=no-member
+            raise ValueError("The template file %s still contains unreplaced values for: %s" % \
+                             (inputfilename, ", ".join(missing)))
+
+        outfile.write(result)
+
+    def _get_unit_file_path(self, name):
+        if self.user:
+            home = os.path.expanduser("~")
+            return os.path.join(SYSTEMD_UNIT_FILES_DEST_USER % home, "%s.service" % name)
+        return os.path.join(SYSTEMD_UNIT_FILES_DEST, "%s.service" % name)
+
+    def _write_unit_file(self, unitfile, unitfileout, values):
         if os.path.exists(unitfile):
             with open(unitfile, 'r') as infile:
                 systemd_template = infile.read()
@@ -344,19 +704,49 @@ class SystemContainers(object):
         except OSError:
             pass
         with open(unitfileout, "w") as outfile:
-            _write_template(unitfile, systemd_template, values, outfile)
+            SystemContainers._write_template(unitfile, systemd_template, values, outfile)
 
+    def _set_deployment(self, name, destination):
+        # Replace the symlink with rename(2), so that it always points to
+        # one of the deployments
         sym = "%s/%s" % (self._get_system_checkout_path(), name)
-        if os.path.exists(sym):
-            os.unlink(sym)
-        os.symlink(destination, sym)
+        tmp = "%s/.%s.tmp" % (self._get_system_checkout_path(), name)
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        os.symlink(destination, tmp)
+        os.rename(tmp, sym)
+        # Record the new checkout in the registry of system containers
+        self.get_system_containers()
+
+    def rollback_system_container(self, name):
+        """
+        Switches the container back to its other deployment, the one it
+        was running before the last update, and restarts it.
+        """
+        self.args.display = False
 
-        self._systemctl_command("enable", name)
-        if upgrade:
-            self._systemctl_command("restart", name)
+        path = os.path.join(self._get_system_checkout_path(), name)
+        current = os.path.realpath(path)
+        if current.endswith(".0"):
+            previous = current[:-2] + ".1"
+        elif current.endswith(".1"):
+            previous = current[:-2] + ".0"
         else:
-            self._systemctl_command("start", name)
-        return
+            raise ValueError("Cannot find the deployment of container '%s'" % name)
+
+        if not os.path.exists(os.path.join(previous, "info")):
+            raise ValueError("Container '%s' has no previous deployment to roll back to" % name)
+
+        with open(os.path.join(previous, "info"), "r") as info_file:
+            info = json.loads(info_file.read())
+
+        util.write_out("Rolling back %s to %s" % (name, previous))
+        unitfile = os.path.join(previous, "rootfs/exports/service.template")
+        self._write_unit_file(unitfile, self._get_unit_file_path(name), info["values"])
+        self._set_deployment(name, previous)
+
+        self._systemctl_command("enable", name)
+        self._systemctl_command("restart", name)
 
     def _get_system_checkout_path(self):
         if os.environ.get("ATOMIC_OSTREE_CHECKOUT_PATH"):
@@ -379,22 +769,69 @@ class SystemContainers(object):
                 "/ostree/repo"
 
     def _get_ostree_repo(self):
-        if not OSTREE_PRESENT:
+        if not load_ostree():
             return None
 
         repo_location = self._get_ostree_repo_location()
-        repo = OSTree.Repo.new(Gio.File.new_for_path(repo_location))
+        # The repository is opened once per process
+        with OSTREE_REPOS_LOCK:
+            if repo_location in OSTREE_REPOS:
+                return OSTREE_REPOS[repo_location].repo
+
+            repo = OSTree.Repo.new(Gio.File.new_for_path(repo_location))
+
+            # If the repository doesn't exist at the specified location, create it
+            if not os.path.exists(os.path.join(repo_location, "config")):
+                os.makedirs(repo_location)
+                if self.user:
+                    repo.create(OSTree.RepoMode.BARE_USER)
+                else:
+                    repo.create(OSTree.RepoMode.BARE)
 
-        # If the repository doesn't exist at the specified location, create it
-        if not os.path.exists(os.path.join(repo_location, "config")):
-            os.makedirs(repo_location)
-            if self.user:
-                repo.create(OSTree.RepoMode.BARE_USER)
-            else:
-                repo.create(OSTree.RepoMode.BARE)
+            repo.open(None)
+            OSTREE_REPOS[repo_location] = OpenedRepo(repo)
+            return repo
 
-        repo.open(None)
-        return repo
+    @staticmethod
+    def _list_refs(repo):
+        """
+        Returns the refs of repo as a dict from ref to checksum.  The
+        listing is cached for repositories opened by _get_ostree_repo().
+        """
+        opened = _opened_repo(repo)
+        if opened is None:
+            return repo.list_refs()[1]
+        with opened.lock:
+            if opened.refs is None:
+                opened.refs = repo.list_refs()[1]
+            return opened.refs
+
+    @staticmethod
+    def _resolve_ref(repo, ref, allow_noent=True):
+        """
+        Like repo.resolve_rev(ref, allow_noent)[1], but image and layer
+        refs are looked up in the cached refs listing.
+        """
+        if ref.startswith((OSTREE_OCIIMAGE_PREFIX, OSTREE_FLATTENED_PREFIX)):
+            rev = SystemContainers._list_refs(repo).get(ref)
+            if rev or allow_noent:
+                return rev
+        return repo.resolve_rev(ref, allow_noent)[1]
+
+    @staticmethod
+    def _load_commit(repo, rev):
+        opened = _opened_repo(repo)
+        if opened is None:
+            return repo.load_commit(rev)[1]
+        with opened.lock:
+            commit = opened.commits.get(rev)
+        if commit is None:
+            commit = repo.load_commit(rev)[1]
+            # Only checksums are immutable
+            if len(rev) == 64:
+                with opened.lock:
+                    opened.commits[rev] = commit
+        return commit
 
     def update_system_container(self, name):
         self.args.display = False
@@ -419,16 +856,40 @@ class SystemContainers(object):
 
         image = info["image"]
         values = info["values"]
-
-        self._checkout_system_container(repo, name, image, next_deployment, True, values)
+        previous = (os.path.join(os.path.realpath(path), "rootfs"), info.get("ostree-commit"))
+
+        self._checkout_system_container(repo, name, image, next_deployment, True, values, previous=previous)
+
+    def _get_runtime_states(self):
+        """
+        Returns the runc state of every container, by id, with a single
+        'runc list' call.  The result is kept for the rest of the
+        invocation.  Returns None if this version of runc cannot list
+        containers as JSON.
+        """
+        if self._runtime_states is None:
+            try:
+                list_stdout = util.check_output([RUNC_PATH, "list", "--format", "json"], stderr=DEVNULL)
+                # runc prints null when there are no containers
+                states = json.loads(list_stdout.decode()) or []
+                self._runtime_states = dict((state["id"], state) for state in states)
+            except (subprocess.CalledProcessError, util.FileNotFound, ValueError, KeyError, TypeError):
+                self._runtime_states = False
+        return self._runtime_states if self._runtime_states is not False else None
 
     def get_container_runtime_info(self, container):
         if self.user:
             return {'status' : 'unknown'}
 
+        states = self._get_runtime_states()
         try:
-            inspect_stdout = util.check_output([RUNC_PATH, "state", container])
-            ret = json.loads(inspect_stdout.decode())
+            if states is not None:
+                if container not in states:
+                    return {}
+                ret = states[container]
+            else:
+                inspect_stdout = util.check_output([RUNC_PATH, "state", container])
+                ret = json.loads(inspect_stdout.decode())
             status = ret["status"]
             created = dateparse(ret['created'])
             return {"status" : status, "created" : created}
@@ -436,40 +897,61 @@ class SystemContainers(object):
             return {}
 
     def get_system_containers(self):
+        """
+        Lists the system containers.  The records read from the checkouts
+        are kept in a cache file, and only read again for the checkouts
+        whose symlink target or info file changed.
+        """
         checkouts = self._get_system_checkout_path()
         if not os.path.exists(checkouts):
             return []
+        cache_name = SYSTEM_CONTAINERS_CACHE % hashlib.sha1(checkouts.encode('utf-8')).hexdigest()
+        cached = util.read_cache_file(cache_name) or {}
+        registry = {}
         ret = []
         for x in os.listdir(checkouts):
             fullpath = os.path.join(checkouts, x)
             if not os.path.islink(fullpath):
                 continue
 
-            with open(os.path.join(fullpath, "info"), "r") as info_file:
-                info = json.load(info_file)
-                revision = info["revision"] if "revision" in info else ""
-                created = info["created"] if "created" in info else ""
-                image = info["image"] if "image" in info else ""
-
-            with open(os.path.join(fullpath, "config.json"), "r") as config_file:
-                config = json.load(config_file)
-                command = u' '.join(config["process"]["args"])
+            stamp = [os.readlink(fullpath), os.stat(os.path.join(fullpath, "info")).st_mtime]
+            entry = cached.get(x)
+            if entry is None or entry["stamp"] != stamp:
+                entry = {"stamp" : stamp, "container" : self._read_system_container(x, fullpath)}
+            registry[x] = entry
+            ret.append(entry["container"])
 
-            container = {'Image' : image, 'ImageID' : revision, 'Id' : x, 'Created' : created, 'Names' : [x],
-                         'Command' : command, 'Type' : 'systemcontainer'}
-            ret.append(container)
+        if registry != cached:
+            util.write_cache_file(cache_name, registry)
         return ret
 
+    @staticmethod
+    def _read_system_container(name, fullpath):
+        with open(os.path.join(fullpath, "info"), "r") as info_file:
+            info = json.load(info_file)
+            revision = info["revision"] if "revision" in info else ""
+            created = info["created"] if "created" in info else ""
+            image = info["image"] if "image" in info else ""
+
+        with open(os.path.join(fullpath, "config.json"), "r") as config_file:
+            config = json.load(config_file)
+            command = u' '.join(config["process"]["args"])
+
+        return {'Image' : image, 'ImageID' : revision, 'Id' : name, 'Created' : created, 'Names' : [name],
+                'Command' : command, 'Type' : 'systemcontainer'}
+
     def delete_image(self, image):
         repo = self._get_ostree_repo()
         if not repo:
             return
         imagebranch = SystemContainers._get_ostree_image_branch(image)
-        commit_rev = repo.resolve_rev(imagebranch, True)
-        if not commit_rev[1]:
+        commit_rev = self._resolve_ref(repo, imagebranch)
+        if not commit_rev:
             return
         ref = OSTree.parse_refspec(imagebranch)
         repo.set_ref_immediate(ref[1], ref[2], None)
+        invalidate_ostree_refs(repo)
+        self._prune_flattened_commits(repo)
 
     def inspect_system_image(self, image):
         repo = self._get_ostree_repo()
@@ -478,47 +960,90 @@ class SystemContainers(object):
         imagebranch = SystemContainers._get_ostree_image_branch(image)
         return self._inspect_system_branch(repo, imagebranch)
 
-    def _inspect_system_branch(self, repo, imagebranch):
-        commit_rev = repo.resolve_rev(imagebranch, False)[1]
-        commit = repo.load_commit(commit_rev)[1]
+    def _inspect_system_branch(self, repo, imagebranch, commit_rev=None, info=None):
+        if commit_rev is None:
+            commit_rev = self._resolve_ref(repo, imagebranch, False)
+        if info is None:
+            info = self._get_commit_info(repo, commit_rev)
 
         branch_id = imagebranch.replace(OSTREE_OCIIMAGE_PREFIX, "")
         tag = ":".join(branch_id.rsplit('-', 1))
-        timestamp = OSTree.commit_get_timestamp(commit)
-        labels = {}
-
-        manifest = self._image_manifest(repo, commit_rev)
         if len(branch_id) == 64:
             image_id = branch_id
             tag = "<none>"
         else:
             image_id = commit_rev
 
-        if manifest:
-            manifest = json.loads(manifest)
-            if 'Labels' in manifest:
-                labels = manifest['Labels']
-
-            if 'Digest' in manifest:
-                image_id = manifest['Digest'].replace("sha256:", "")
+        if info['Digest']:
+            image_id = info['Digest']
 
         if self.user:
             image_type = "User"
         else:
             image_type = "System"
 
-        return {'Id' : image_id, 'RepoTags' : [tag], 'Names' : [], 'Created': timestamp,
-                'ImageType' : image_type, 'Labels' : labels, 'OSTree-rev' : commit_rev}
+        return {'Id' : image_id, 'RepoTags' : [tag], 'Names' : [], 'Created': info['Created'],
+                'ImageType' : image_type, 'Labels' : info['Labels'], 'OSTree-rev' : commit_rev}
+
+    def _get_commit_info(self, repo, rev):
+        """
+        Returns the parts of the image record that come from the commit
+        rev: its timestamp and the labels, digest and layers of its
+        manifest.
+        """
+        commit = self._load_commit(repo, rev)
+        info = {'Created' : OSTree.commit_get_timestamp(commit), 'Labels' : {},
+                'Digest' : None, 'Layers' : None}
+        manifest = self._image_manifest(repo, rev)
+        if manifest:
+            manifest = json.loads(manifest)
+            if 'Labels' in manifest:
+                info['Labels'] = manifest['Labels']
+            if 'Digest' in manifest:
+                info['Digest'] = manifest['Digest'].replace("sha256:", "")
+            info['Layers'] = SystemContainers.get_layers_from_manifest(manifest)
+        return info
+
+    def _get_commit_infos(self, repo, revs):
+        """
+        Returns _get_commit_info() of every rev in revs.  Commits are
+        immutable, so the results are kept in a cache file indexed by
+        commit checksum, and only new commits are loaded.
+        """
+        refs = self._list_refs(repo)
+        location = repo.get_path().get_path()
+        cache_name = SYSTEM_IMAGES_CACHE % hashlib.sha1(location.encode('utf-8')).hexdigest()
+        cached = util.read_cache_file(cache_name) or {}
+        infos = {}
+        changed = False
+        for rev in revs:
+            info = cached.get(rev)
+            if info is None:
+                info = cached[rev] = self._get_commit_info(repo, rev)
+                changed = True
+            infos[rev] = info
+
+        # Forget the commits no ref points to anymore
+        in_use = set(refs.values())
+        for rev in list(cached.keys()):
+            if rev not in in_use:
+                del cached[rev]
+                changed = True
+        if changed:
+            util.write_cache_file(cache_name, cached)
+        return infos
 
     def get_system_images(self, get_all=False, repo=None):
         if repo is None:
             repo = self._get_ostree_repo()
             if repo is None:
                 return []
-        revs = [x for x in repo.list_refs()[1] if x.startswith(OSTREE_OCIIMAGE_PREFIX) \
+        refs = self._list_refs(repo)
+        revs = [x for x in refs if x.startswith(OSTREE_OCIIMAGE_PREFIX) \
                 and (get_all or len(x) != len(OSTREE_OCIIMAGE_PREFIX) + 64)]
 
-        return [self._inspect_system_branch(repo, x) for x in revs]
+        infos = self._get_commit_infos(repo, [refs[x] for x in revs])
+        return [self._inspect_system_branch(repo, x, refs[x], infos[refs[x]]) for x in revs]
 
     def _systemctl_command(self, command, name):
         if self.user:
@@ -551,48 +1076,136 @@ class SystemContainers(object):
 
         if os.path.lexists("%s/%s" % (self._get_system_checkout_path(), name)):
             os.unlink("%s/%s" % (self._get_system_checkout_path(), name))
+            # Drop the checkout from the registry of system containers
+            self.get_system_containers()
         for deploy in ["0", "1"]:
             if os.path.exists("%s/%s.%s" % (self._get_system_checkout_path(), name, deploy)):
                 shutil.rmtree("%s/%s.%s" % (self._get_system_checkout_path(), name, deploy))
 
-        if self.user:
-            home = os.path.expanduser("~")
-            unitfileout = os.path.join(SYSTEMD_UNIT_FILES_DEST_USER % home, "%s.service" % name)
-        else:
-            unitfileout = os.path.join(SYSTEMD_UNIT_FILES_DEST, "%s.service" % name)
+        unitfileout = self._get_unit_file_path(name)
 
         if os.path.exists(unitfileout):
             os.unlink(unitfileout)
 
-    def prune_ostree_images(self):
+    def prune_ostree_images(self, timeout=None):
+        """
+        Deletes the layer and flattened refs that are not reachable anymore,
+        then the objects no ref points to.  Deleting the objects stops
+        after timeout seconds; what is left is deleted by the next prune.
+        :return: the bytes freed, or None if the timeout expired
+        """
         repo = self._get_ostree_repo()
         if not repo:
-            return
-        refs = {}
-        app_refs = []
+            return 0
 
-        for i in repo.list_refs()[1]:
-            if i.startswith(OSTREE_OCIIMAGE_PREFIX):
-                if len(i) == len(OSTREE_OCIIMAGE_PREFIX) + 64:
-                    refs[i] = False
-                else:
-                    app_refs.append(i)
+        location = repo.get_path().get_path()
+        lock = RepoLock(location, exclusive=True)
+        if not lock.acquire(blocking=False):
+            util.write_err("Another atomic process is writing to %s, not pruning it" % location)
+            return 0
+        try:
+            unreachable = self._get_unreachable_refs(repo)
+            for i in unreachable:
+                util.write_out("Deleting %s" % i)
+            self._delete_refs(repo, unreachable)
+            digests = util.read_cache_file(DOCKERTAR_DIGESTS_CACHE)
+            if digests:
+                cached = len(digests)
+                SystemContainers._prune_dockertar_digests(repo, digests)
+                if len(digests) != cached:
+                    util.write_cache_file(DOCKERTAR_DIGESTS_CACHE, digests)
+
+            sysroot = SystemContainers._lock_sysroot(location)
+            if sysroot is False:
+                util.write_err("The OSTree sysroot is locked by another process, not deleting unused objects")
+                return 0
+            try:
+                return SystemContainers._prune_objects(repo, timeout)
+            finally:
+                if sysroot:
+                    sysroot.unlock()
+        finally:
+            lock.release()
 
-        def visit(rev):
-            manifest = self._image_manifest(repo, repo.resolve_rev(rev, True)[1])
-            if not manifest:
-                return
-            for layer in SystemContainers.get_layers_from_manifest(json.loads(manifest)):
-                refs[OSTREE_OCIIMAGE_PREFIX + layer.replace("sha256:", "")] = True
+    @staticmethod
+    def _lock_sysroot(location):
+        """
+        If location is the repository of the host OS, that rpm-ostree also
+        writes to, locks the sysroot.
+        :return: the locked sysroot, None if location is another
+        repository, or False if the sysroot is locked already
+        """
+        sysroot = OSTree.Sysroot.new_default()
+        sysroot_repo = os.path.join(sysroot.get_path().get_path(), "ostree/repo")
+        if os.path.realpath(sysroot_repo) != os.path.realpath(location):
+            return None
+        if not sysroot.try_lock()[1]:
+            return False
+        return sysroot
 
-        for app in app_refs:
-            visit(app)
+    @staticmethod
+    def _prune_objects(repo, timeout):
+        cancellable = Gio.Cancellable()
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, cancellable.cancel)
+            timer.daemon = True
+            timer.start()
+        try:
+            _, _, _, freed = repo.prune(OSTree.RepoPruneFlags.REFS_ONLY, -1, cancellable)
+        except GLib.Error: # pylint: disable=catching-non-exception
+            if not cancellable.is_cancelled():
+                raise
+            return None
+        finally:
+            if timer:
+                timer.cancel()
+        return freed
+
+    def get_ostree_reclaimable_space(self):
+        """
+        Returns what prune_ostree_images() would free, as a list of
+        (name, bytes): one entry for each unreachable ref, with the size of
+        the objects no other ref holds, and one for the objects that no ref
+        points to already.  Objects are counted once.
+        """
+        repo = self._get_ostree_repo()
+        if not repo:
+            return []
+        refs = self._list_refs(repo)
+        unreachable = self._get_unreachable_refs(repo)
+
+        counted = set()
+        for i in refs:
+            if i not in unreachable:
+                counted.update(SystemContainers._get_reachable_objects(repo, refs[i]))
+
+        ret = []
+        for i in unreachable:
+            objects = SystemContainers._get_reachable_objects(repo, refs[i]) - counted
+            counted.update(objects)
+            ret.append((i, SystemContainers._get_objects_size(repo, objects)))
+
+        _, all_objects = repo.list_objects(OSTree.RepoListObjectsFlags.ALL, None)
+        orphans = set(x.unpack() for x in all_objects) - counted
+        if orphans:
+            ret.append(("<unreferenced objects>", SystemContainers._get_objects_size(repo, orphans)))
+        return ret
+
+    @staticmethod
+    def _get_reachable_objects(repo, rev):
+        """
+        Returns the objects of rev and its history, as (checksum, type).
+        """
+        _, reachable = repo.traverse_commit(rev, -1, None)
+        return set(x.unpack() for x in reachable)
 
-        for k, v in refs.items():
-            if not v:
-                ref = OSTree.parse_refspec(k)
-                util.write_out("Deleting %s" % k)
-                repo.set_ref_immediate(ref[1], ref[2], None)
+    @staticmethod
+    def _get_objects_size(repo, objects):
+        size = 0
+        for checksum, objtype in objects:
+            size += repo.query_object_storage_size(objtype, checksum, None)[1]
+        return size
 
     @staticmethod
     def get_default_system_name(image):
@@ -637,10 +1250,6 @@ class SystemContainers(object):
         args, img = self._convert_to_skopeo(image)
         return util.skopeo_inspect(img, args)
 
-    def _skopeo_get_layers(self, image, layers):
-        args, img = self._convert_to_skopeo(image)
-        return util.skopeo_layers(img, args, layers)
-
     def _image_manifest(self, repo, rev):
         return SystemContainers._get_commit_metadata(repo, rev, "docker.manifest")
 
@@ -653,10 +1262,10 @@ class SystemContainers(object):
             return self._skopeo_get_manifest(image)
 
         imagebranch = SystemContainers._get_ostree_image_branch(image)
-        commit_rev = repo.resolve_rev(imagebranch, True)
-        if not commit_rev[1]:
+        commit_rev = self._resolve_ref(repo, imagebranch)
+        if not commit_rev:
             return None
-        return self._image_manifest(repo, commit_rev[1])
+        return self._image_manifest(repo, commit_rev)
 
     @staticmethod
     def get_layers_from_manifest(manifest):
@@ -672,9 +1281,49 @@ class SystemContainers(object):
         return layers
 
     @staticmethod
-    def _import_layers_into_ostree(repo, imagebranch, manifest, layers):
+    def _import_layers_into_ostree(repo, imagebranch, manifest, layers, layer_done=None):
+        """
+        Imports layers, (layer, tarball or directory) pairs, and creates
+        imagebranch for manifest.  The layers are committed concurrently,
+        each by its own worker; the refs are all set at the end in a
+        single transaction.  layers can be a generator, it is consumed as
+        workers become free.  If set, layer_done(layer, path) is called
+        once a layer was imported, or failed to.
+        """
+        if isinstance(layers, dict):
+            layers = layers.items()
+        location = repo.get_path().get_path()
+
+        def import_layer(item):
+            layer, path = item
+            try:
+                return layer, SystemContainers._write_layer_commit(location, layer, path)
+            finally:
+                if layer_done:
+                    layer_done(layer, path)
+
+        commits = util.parallel_map(import_layer, layers, workers=multiprocessing.cpu_count())
+
         repo.prepare_transaction()
-        for layer, tar in layers.items():
+        try:
+            for layer, csum in commits:
+                repo.transaction_set_ref(None, "%s%s" % (OSTREE_OCIIMAGE_PREFIX, layer), csum)
+            SystemContainers._write_image_branch(repo, imagebranch, manifest)
+        except: #pylint: disable=bare-except
+            repo.abort_transaction(None)
+            raise
+        repo.commit_transaction(None)
+        invalidate_ostree_refs(repo)
+
+    @staticmethod
+    def _write_layer_commit(location, layer, path):
+        # Every worker uses its own repository object and transaction, the
+        # libostree calls release the GIL so the layers are written in
+        # parallel.  Only the objects are written here, not the refs.
+        repo = OSTree.Repo.new(Gio.File.new_for_path(location))
+        repo.open(None)
+        repo.prepare_transaction()
+        try:
             mtree = OSTree.MutableTree()
             def filter_func(*args):
                 info = args[2]
@@ -682,13 +1331,22 @@ class SystemContainers(object):
                     info.set_attribute_uint32("unix::mode", info.get_attribute_uint32("unix::mode") | stat.S_IWUSR)
                 return OSTree.RepoCommitFilterResult.ALLOW
 
-            modifier = OSTree.RepoCommitModifier.new(0, filter_func, None)
-            repo.write_archive_to_mtree(Gio.File.new_for_path(tar), mtree, modifier, True)
+            if os.path.isdir(path):
+                SystemContainers._write_diff_directory_to_mtree(repo, path, mtree, filter_func)
+            else:
+                modifier = OSTree.RepoCommitModifier.new(0, filter_func, None)
+                repo.write_archive_to_mtree(Gio.File.new_for_path(path), mtree, modifier, True)
             root = repo.write_mtree(mtree)[1]
             metav = GLib.Variant("a{sv}", {'docker.layer': GLib.Variant('s', layer)})
             csum = repo.write_commit(None, "", None, metav, root)[1]
-            repo.transaction_set_ref(None, "%s%s" % (OSTREE_OCIIMAGE_PREFIX, layer), csum)
+        except: #pylint: disable=bare-except
+            repo.abort_transaction(None)
+            raise
+        repo.commit_transaction(None)
+        return csum
 
+    @staticmethod
+    def _write_image_branch(repo, imagebranch, manifest):
         # create a $OSTREE_OCIIMAGE_PREFIX$image-$tag branch
         if not isinstance(manifest, str):
             manifest = json.dumps(manifest)
@@ -708,48 +1366,158 @@ class SystemContainers(object):
         csum = repo.write_commit(None, "", None, metadata, root)[1]
         repo.transaction_set_ref(None, imagebranch, csum)
 
-        repo.commit_transaction(None)
+    @staticmethod
+    def _write_diff_directory_to_mtree(repo, directory, mtree, filter_func):
+        """
+        Writes an overlay diff directory to mtree.  Whiteouts, character
+        devices 0:0 and directories with the trusted.overlay.opaque
+        attribute, are converted to the .wh. files of the layer tarballs.
+        """
+        whiteouts = []
+        def diff_filter(*args):
+            path, info = args[1], args[2]
+            mode = info.get_attribute_uint32("unix::mode")
+            whiteout = SystemContainers._get_overlay_whiteout(directory, path, mode,
+                                                              info.get_attribute_uint32("unix::rdev"))
+            if whiteout:
+                whiteouts.append(whiteout)
+                if stat.S_ISCHR(mode):
+                    return OSTree.RepoCommitFilterResult.SKIP
+            return filter_func(*args)
+
+        # The layer tarballs carry no xattrs, so neither the SELinux labels
+        # of the Docker storage nor the trusted.overlay.* ones are committed
+        modifier = OSTree.RepoCommitModifier.new(OSTree.RepoCommitModifierFlags.SKIP_XATTRS, diff_filter, None)
+        repo.write_directory_to_mtree(Gio.File.new_for_path(directory), mtree, modifier)
+
+        if not whiteouts:
+            return
+        empty = SystemContainers._write_empty_file(repo)
+        for path in whiteouts:
+            parent = mtree
+            for part in os.path.dirname(path).split("/"):
+                if part:
+                    parent = parent.ensure_dir(part)[1]
+            parent.replace_file(os.path.basename(path), empty)
+
+    @staticmethod
+    def _get_overlay_whiteout(directory, path, mode, rdev):
+        """
+        Returns the .wh. file of the layer tarballs standing for path in
+        the overlay diff directory, or None if path is neither a whiteout
+        nor an opaque directory.
+        """
+        if stat.S_ISCHR(mode) and rdev == 0:
+            return os.path.join(os.path.dirname(path), ".wh." + os.path.basename(path))
+        if stat.S_ISDIR(mode):
+            try:
+                if os.getxattr(os.path.join(directory, path.lstrip("/")), "trusted.overlay.opaque") == b"y":
+                    return os.path.join(path, ".wh..wh..opq")
+            except OSError:
+                pass
+        return None
+
+    @staticmethod
+    def _write_empty_file(repo):
+        file_info = Gio.FileInfo()
+        file_info.set_file_type(Gio.FileType.REGULAR)
+        file_info.set_size(0)
+        file_info.set_attribute_uint32("unix::uid", 0)
+        file_info.set_attribute_uint32("unix::gid", 0)
+        file_info.set_attribute_uint32("unix::mode", 0o644 | stat.S_IFREG)
+        _, content, length = OSTree.raw_file_to_content_stream(Gio.MemoryInputStream.new(), file_info, None, None)
+        csum = repo.write_content(None, content, length, None)[1]
+        return OSTree.checksum_from_bytes(csum)
+
+    def _get_docker_graph_layers(self, image):
+        """
+        Returns the image ID and the list of (layer, directory) of image,
+        from the bottom layer up, if image is stored by the overlay or
+        overlay2 graph drivers.  Returns None, None otherwise.
+        """
+        # The graph driver directories are only readable by root, and
+        # their whiteouts can only be read through os.getxattr
+        if self.user or not hasattr(os, "getxattr"):
+            return None, None
+        with AtomicDocker() as client:
+            inspect = client.inspect_image(image)
+        driver = inspect.get("GraphDriver") or {}
+        data = driver.get("Data") or {}
+        if driver.get("Name") == "overlay2" and data.get("UpperDir"):
+            dirs = [data["UpperDir"]] + [x for x in (data.get("LowerDir") or "").split(":") if x]
+            dirs.reverse()
+            diff_ids = ((inspect.get("RootFS") or {}).get("Layers") or [])
+            if len(diff_ids) != len(dirs):
+                return None, None
+            layers = [(layer.replace("sha256:", ""), d) for layer, d in zip(diff_ids, dirs)]
+        elif driver.get("Name") == "overlay" and data.get("RootDir"):
+            # Every overlay layer holds the complete tree of the image
+            layers = [(inspect["Id"].replace("sha256:", ""), data["RootDir"])]
+        else:
+            return None, None
+        if not all(os.path.isdir(d) for _, d in layers):
+            return None, None
+        return inspect["Id"], layers
+
+    def _pull_docker_graph(self, repo, image):
+        """
+        Imports image straight from the directories of the Docker graph
+        driver.  Returns False if the storage of image is not supported.
+        """
+        _, layers = self._get_docker_graph_layers(image)
+        if layers is None:
+            return False
+
+        _, name, tag = SystemContainers._parse_imagename(image)
+        imagebranch = "%s%s-%s" % (OSTREE_OCIIMAGE_PREFIX, name.replace("sha256:", ""), tag)
+        manifest = json.dumps({"Layers" : [layer for layer, _ in layers]})
+        layers_to_import = [(layer, d) for layer, d in layers
+                            if not self._resolve_ref(repo, "%s%s" % (OSTREE_OCIIMAGE_PREFIX, layer))]
+        SystemContainers._import_layers_into_ostree(repo, imagebranch, manifest, layers_to_import)
+        return True
 
     def _pull_docker_image(self, repo, image):
+        try:
+            if self._pull_docker_graph(repo, image):
+                return
+        except (OSError, GLib.Error, APIError) as e: # pylint: disable=catching-non-exception
+            util.write_err("Cannot import %s from the Docker storage, using docker save: %s" % (image, e))
+
         with tempfile.NamedTemporaryFile(mode="w") as temptar:
             util.check_call(["docker", "save", "-o", temptar.name, image])
             return self._pull_docker_tar(repo, temptar.name)
 
     def _pull_docker_tar(self, repo, image):
+        # The members are read straight from the archive, only a FIFO is
+        # created in temp_dir to hand the layers over to OSTree.
         temp_dir = tempfile.mkdtemp()
         try:
             with tarfile.open(image, 'r') as t:
-                t.extractall(temp_dir)
-                manifest_file = os.path.join(temp_dir, "manifest.json")
-                if os.path.exists(manifest_file):
-                    manifest = ""
-                    with open(manifest_file, 'r') as mfile:
-                        manifest = mfile.read()
+                names = t.getnames()
+                if "manifest.json" in names:
+                    manifest = t.extractfile("manifest.json").read().decode('utf-8')
                     for m in json.loads(manifest):
                         _, image, tag = SystemContainers._parse_imagename(m["RepoTags"][0])
                         imagebranch = "%s%s-%s" % (OSTREE_OCIIMAGE_PREFIX, image.replace("sha256:", ""), tag)
                         input_layers = m["Layers"]
-                        self._pull_dockertar_layers(repo, imagebranch, temp_dir, input_layers)
+                        self._pull_dockertar_layers(repo, imagebranch, t, temp_dir, input_layers)
                 else:
-                    repositories = ""
-                    repositories_file = os.path.join(temp_dir, "repositories")
-                    with open(repositories_file, 'r') as rfile:
-                        repositories = rfile.read()
+                    repositories = t.extractfile("repositories").read().decode('utf-8')
                     _, image, tag = SystemContainers._parse_imagename(list(json.loads(repositories).keys())[0])
                     imagebranch = "%s%s-%s" % (OSTREE_OCIIMAGE_PREFIX, image, tag)
                     input_layers = []
-                    for name in os.listdir(temp_dir):
+                    for name in sorted(set(n.split("/")[0] for n in names)):
                         if name == "repositories":
                             continue
                         input_layers.append(name + "/layer.tar")
-                    self._pull_dockertar_layers(repo, imagebranch, temp_dir, input_layers)
+                    self._pull_dockertar_layers(repo, imagebranch, t, temp_dir, input_layers)
         finally:
             shutil.rmtree(temp_dir)
 
     def _check_system_ostree_image(self, repo, img, upgrade):
         imagebranch = img.replace("ostree:", "")
-        current_rev = repo.resolve_rev(imagebranch, True)
-        if not upgrade and current_rev[1]:
+        current_rev = self._resolve_ref(repo, imagebranch)
+        if not upgrade and current_rev:
             return False
         remote, branch = imagebranch.split(":")
         return repo.pull(remote, [branch], 0, None)
@@ -757,41 +1525,93 @@ class SystemContainers(object):
     def _check_system_oci_image(self, repo, img, upgrade):
         _, image, tag = SystemContainers._parse_imagename(img.replace("oci:", ""))
         imagebranch = "%s%s-%s" % (OSTREE_OCIIMAGE_PREFIX, image.replace("sha256:", ""), tag)
-        current_rev = repo.resolve_rev(imagebranch, True)
-        if not upgrade and current_rev[1]:
+        current_rev = self._resolve_ref(repo, imagebranch)
+        if not upgrade and current_rev:
             return False
 
-        manifest = self._skopeo_get_manifest(img)
+        # The remote image is looked up once for the manifest and all the
+        # layers
+        skopeo_args, fqn = self._convert_to_skopeo(img)
+        manifest = util.skopeo_inspect(fqn, skopeo_args)
         layers = SystemContainers.get_layers_from_manifest(manifest)
         missing_layers = []
         for i in layers:
             layer = i.replace("sha256:", "")
-            if not repo.resolve_rev("%s%s" % (OSTREE_OCIIMAGE_PREFIX, layer), True)[1]:
+            if layer not in missing_layers and \
+               not self._resolve_ref(repo, "%s%s" % (OSTREE_OCIIMAGE_PREFIX, layer)):
                 missing_layers.append(layer)
                 util.write_out("Missing layer %s" % layer)
 
-        layers_dir = None
+        # Layers are downloaded one at a time in a thread and each one is
+        # imported as soon as it is available and an import worker is
+        # free.  The queue bounds how many downloaded layers wait on disk
+        # for the import.
+        downloaded = Queue(maxsize=LAYERS_DOWNLOAD_AHEAD)
+        stop = threading.Event()
+        done = threading.Event()
+
+        def download():
+            try:
+                for n, layer in enumerate(missing_layers):
+                    if stop.is_set():
+                        break
+                    util.write_out("Downloading layer %s (%d/%d)" % (layer, n + 1, len(missing_layers)))
+                    layers_dir = util.skopeo_layers(fqn, skopeo_args, [layer])
+                    downloaded.put((layer, layers_dir))
+            except Exception as e: # pylint: disable=broad-except
+                downloaded.put((None, e))
+            downloaded.put(None)
+
+        layers_dirs = {}
+
+        def layers_to_import():
+            for n in range(len(missing_layers)):
+                item = downloaded.get()
+                if item is None:
+                    done.set()
+                    raise ValueError("Download of the layers stopped early")
+                layer, layers_dir = item
+                if layer is None:
+                    raise layers_dir
+                layer_file = SystemContainers._find_layer_tar(layers_dir, layer)
+                if layer_file is None:
+                    shutil.rmtree(layers_dir)
+                    continue
+                layers_dirs[layer] = layers_dir
+                util.write_out("Importing layer %s (%d/%d)" % (layer, n + 1, len(missing_layers)))
+                yield layer, layer_file
+
+        def layer_done(layer, _):
+            shutil.rmtree(layers_dirs.pop(layer))
+
+        downloader = threading.Thread(target=download)
+        downloader.daemon = True
+        downloader.start()
         try:
-            layers_to_import = {}
-            if len(missing_layers):
-                layers_dir = self._skopeo_get_layers(img, missing_layers)
-                for root, _, files in os.walk(layers_dir):
-                    for f in files:
-                        if f.endswith(".tar"):
-                            layer_file = os.path.join(root, f)
-                            layer = f.replace(".tar", "")
-                            if layer in missing_layers:
-                                layers_to_import[layer] = layer_file
-
-            SystemContainers._import_layers_into_ostree(repo, imagebranch, manifest, layers_to_import)
+            SystemContainers._import_layers_into_ostree(repo, imagebranch, manifest, layers_to_import(),
+                                                        layer_done=layer_done)
         finally:
-            if layers_dir:
-                shutil.rmtree(layers_dir)
+            stop.set()
+            # Unblock the downloader and drop what it left behind
+            while not done.is_set():
+                item = downloaded.get()
+                if item is None:
+                    break
+                if item[0] is not None:
+                    shutil.rmtree(item[1])
+            downloader.join()
         return True
 
+    @staticmethod
+    def _find_layer_tar(layers_dir, layer):
+        for root, _, files in os.walk(layers_dir):
+            if layer + ".tar" in files:
+                return os.path.join(root, layer + ".tar")
+        return None
+
     @staticmethod
     def _get_commit_metadata(repo, rev, key):
-        commit = repo.load_commit(rev)[1]
+        commit = SystemContainers._load_commit(repo, rev)
         metadata = commit.get_child_value(0)
         if key not in metadata.keys():
             return None
@@ -812,39 +1632,86 @@ class SystemContainers(object):
             imagebranch = "%s%s-%s" % (OSTREE_OCIIMAGE_PREFIX, image.replace("sha256:", ""), tag)
         return imagebranch
 
+    def has_system_container_branch(self, img):
+        """
+        Checks for the branch of img in the OSTree repository from the
+        ref file, without loading OSTree.  Image IDs are not looked up,
+        see has_system_container_image().
+        """
+        if img.startswith("ostree:"):
+            return False
+        imagebranch = SystemContainers._get_ostree_image_branch(img)
+        return os.path.isfile(os.path.join(self._get_ostree_repo_location(), "refs", "heads", imagebranch))
+
     def has_system_container_image(self, img):
         repo = self._get_ostree_repo()
         if not repo:
             return False
         try:
             imagebranch = SystemContainers._get_ostree_image_branch(img)
-            return repo.resolve_rev(imagebranch, False)[0]
+            if self._resolve_ref(repo, imagebranch):
+                return True
         except: #pylint: disable=bare-except
-            for i in self.get_system_images(get_all=True):
-                if i['Id'].startswith(img):
-                    return True
-            return False
+            pass
+        for i in self.get_system_images(get_all=True):
+            if i['Id'].startswith(img):
+                return True
+        return False
 
-    def _pull_dockertar_layers(self, repo, imagebranch, temp_dir, input_layers):
+    @staticmethod
+    def _prune_dockertar_digests(repo, digests, keep=()):
+        """
+        Drops from the cached digests the layers that have no ref in repo
+        anymore, except the keys in keep, so that the cache does not grow
+        with every docker save import.
+        """
+        refs = SystemContainers._list_refs(repo)
+        for k in list(digests.keys()):
+            if k not in keep and "%s%s" % (OSTREE_OCIIMAGE_PREFIX, digests[k].replace("sha256:", "")) not in refs:
+                del digests[k]
+
+    def _pull_dockertar_layers(self, repo, imagebranch, tar, temp_dir, input_layers):
         layers = {}
         next_layer = {}
         top_layer = None
         for i in input_layers:
             layer = i.replace("/layer.tar", "")
-            layers[layer] = os.path.join(temp_dir, i)
-            with open(os.path.join(temp_dir, layer, "json"), 'r') as f:
-                json_layer = json.loads(f.read())
-                parent = json_layer.get("parent")
-                if not parent:
-                    top_layer = layer
-                next_layer[parent] = layer
-
-        layers_map = {}
+            layers[layer] = i
+            json_layer = json.loads(tar.extractfile("%s/json" % layer).read().decode('utf-8'))
+            parent = json_layer.get("parent")
+            if not parent:
+                top_layer = layer
+            next_layer[parent] = layer
+
+        # Layers are named after the digest of their gzip compressed
+        # content.  It is expensive to compute, so it is computed in
+        # parallel and cached by layer ID, size and modification time.
+        def digest_key(layer):
+            info = tar.getmember(layers[layer])
+            return "%s-%d-%d" % (layer, info.size, info.mtime)
+
+        def compute_digest(layer):
+            fifo = os.path.join(temp_dir, "%s.tar" % layer)
+            os.mkfifo(fifo)
+            # Each worker reads the archive through its own file object
+            with tarfile.open(tar.name, 'r') as t:
+                with FifoWriter(t.extractfile(layers[layer]), fifo):
+                    out = util.check_output([ATOMIC_LIBEXEC + '/dockertar-sha256-helper', fifo],
+                                            stderr=DEVNULL)
+            os.unlink(fifo)
+            return out.decode(enc).replace("\n", "")
+
         enc = sys.getdefaultencoding()
-        for k, v in layers.items():
-            out = util.check_output([ATOMIC_LIBEXEC + '/dockertar-sha256-helper', v],
-                                    stderr=DEVNULL)
-            layers_map[k] = out.decode(enc).replace("\n", "")
+        digests = util.read_cache_file(DOCKERTAR_DIGESTS_CACHE) or {}
+        missing = [k for k in layers if digest_key(k) not in digests]
+        if missing:
+            computed = util.parallel_map(compute_digest, missing, workers=multiprocessing.cpu_count())
+            for k, digest in zip(missing, computed):
+                digests[digest_key(k)] = digest
+            SystemContainers._prune_dockertar_digests(repo, digests, keep=set(digest_key(k) for k in layers))
+            util.write_cache_file(DOCKERTAR_DIGESTS_CACHE, digests)
+        layers_map = dict((k, digests[digest_key(k)]) for k in layers)
+
         layers_ordered = []
 
         it = top_layer
@@ -854,7 +1721,26 @@ class SystemContainers(object):
 
         manifest = json.dumps({"Layers" : layers_ordered})
 
-        layers_to_import = {}
-        for k, v in layers.items():
-            layers_to_import[layers_map[k]] = v
-        SystemContainers._import_layers_into_ostree(repo, imagebranch, manifest, layers_to_import)
+        # Every layer is streamed through its own FIFO, from its own
+        # handle on the archive, as they are imported concurrently
+        writers = {}
+
+        def layers_to_import():
+            for k, v in layers.items():
+                layer = layers_map[k]
+                if layer in writers:
+                    continue
+                fifo = os.path.join(temp_dir, "%s.tar" % k)
+                os.mkfifo(fifo)
+                t = tarfile.open(tar.name, 'r')
+                writers[layer] = (t, FifoWriter(t.extractfile(v), fifo).start())
+                yield layer, fifo
+
+        def layer_done(layer, fifo):
+            t, writer = writers[layer]
+            writer.stop()
+            t.close()
+            os.unlink(fifo)
+
+        SystemContainers._import_layers_into_ostree(repo, imagebranch, manifest, layers_to_import(),
+                                                    layer_done=layer_done)
@@ -4,12 +4,17 @@ import sys
 import json
 import subprocess
 import collections
-from fnmatch import fnmatch as matches
+import fnmatch
 import os
-import selinux
 from .client import AtomicDocker
 from yaml import load as yaml_load
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+import hashlib
 import tempfile
+import threading
 import shutil
 import re
 import requests
@@ -44,17 +49,80 @@ def decompose(compound_name):
         repo, tag = repo.rsplit(':', 1)
     return reg, repo, tag
 
+def glob_matcher(pattern):
+    # Returns a function matching a string against the shell-style
+    # pattern, compiled once.  Patterns without wildcards are compared
+    # as strings.
+    if pattern == '*':
+        return lambda s: True
+    if not any(c in pattern for c in '*?['):
+        return lambda s: s == pattern
+    return re.compile(fnmatch.translate(pattern)).match
+
+class NameMatcher(object):
+    """
+    Matches '[reg/]repo[:tag]' names against img_name, with the same
+    rules as image_by_name().
+    """
+    def __init__(self, img_name):
+        self.name = img_name
+        i_reg, i_rep, i_tag = decompose(img_name)
+        # Correct for bash-style matching expressions.
+        self.reg = glob_matcher(i_reg or '*')
+        self.rep = glob_matcher(i_rep)
+        self.tag = glob_matcher(i_tag or '*')
+        self.literal_rep = i_rep if not any(c in i_rep for c in '*?[') else None
+
+    def match_parts(self, reg, rep, tag):
+        if self.reg(reg) and self.rep(rep) and self.tag(tag):
+            return True
+        # Some repo after decompose end up with the img_name
+        # at the end.  i.e. rhel7/rsyslog
+        return rep.endswith(self.name)
+
+    def match(self, name):
+        return self.match_parts(*decompose(name))
+
+def images_by_names(img_names, images=None):
+    # Returns a dict mapping each of img_names to the list of image data
+    # for the images matching it, as image_by_name() would, in a single
+    # pass over the tags.
+    if images is None:
+        with AtomicDocker() as c:
+            images = c.images(all=False)
+
+    matchers = [NameMatcher(n) for n in set(img_names)]
+    # Names with a literal repository only need to look at the tags of
+    # that repository, or of the ones ending with the name
+    literal = {}
+    wildcard = []
+    for m in matchers:
+        if m.literal_rep is not None:
+            literal.setdefault(m.literal_rep, []).append(m)
+        else:
+            wildcard.append(m)
+    by_suffix = dict((m.name, m) for m in matchers)
+
+    found = dict((m.name, []) for m in matchers)
+    for i in images:
+        matched = set()
+        for t in i['RepoTags'] or []:
+            reg, rep, tag = decompose(t)
+            for m in literal.get(rep, []) + wildcard:
+                if m.name not in matched and m.match_parts(reg, rep, tag):
+                    matched.add(m.name)
+            for n in range(len(rep) + 1):
+                if rep[n:] in by_suffix:
+                    matched.add(rep[n:])
+        for name in matched:
+            found[name].append(i)
+    return found
+
 def image_by_name(img_name, images=None):
     # Returns a list of image data for images which match img_name. Will
     # optionally take a list of images from a docker.Client.images
     # query to avoid multiple docker queries.
-    i_reg, i_rep, i_tag = decompose(img_name)
-
-    # Correct for bash-style matching expressions.
-    if not i_reg:
-        i_reg = '*'
-    if not i_tag:
-        i_tag = '*'
+    matcher = NameMatcher(img_name)
 
     # If the images were not passed in, go get them.
     if images is None:
@@ -64,15 +132,7 @@ def image_by_name(img_name, images=None):
     valid_images = []
     for i in images:
         for t in i['RepoTags']:
-            reg, rep, tag = decompose(t)
-            if matches(reg, i_reg) \
-                    and matches(rep, i_rep) \
-                    and matches(tag, i_tag):
-                valid_images.append(i)
-                break
-            # Some repo after decompose end up with the img_name
-            # at the end.  i.e. rhel7/rsyslog
-            if rep.endswith(img_name):
+            if matcher.match(t):
                 valid_images.append(i)
                 break
     return valid_images
@@ -137,6 +197,7 @@ def call(cmd, env=None, stdin=None, stderr=None, stdout=None):
         raise
 
 def default_container_context():
+    import selinux
     if selinux.is_selinux_enabled() != 0:
         with open(selinux.selinux_lxc_contexts_path()) as fd:
             for i in fd.readlines():
@@ -146,6 +207,7 @@ def default_container_context():
     return ""
 
 def default_ro_container_context():
+    import selinux
     if selinux.is_selinux_enabled() != 0:
         return selinux.getfilecon("/usr")[1]
     return ""
@@ -316,14 +378,86 @@ class DockerObjectNotFound(ValueError):
     def __init__(self, msg):
         super(DockerObjectNotFound, self).__init__("Unable to associate '{}' with an image or container".format(msg))
 
+def get_cache_dir():
+    # Directory holding atomic's persistent caches.  Everything stored
+    # there can be regenerated, so it is safe to remove at any time.
+    if os.environ.get('ATOMIC_CACHE_DIR'):
+        return os.environ.get('ATOMIC_CACHE_DIR')
+    if is_user_mode():
+        return os.path.join(os.path.expanduser("~"), ".cache", "atomic")
+    return "/var/cache/atomic"
+
+def read_cache_file(name):
+    """
+    Returns the JSON content of the cache file name, or None if it
+    does not exist or cannot be parsed.
+    """
+    try:
+        with open(os.path.join(get_cache_dir(), name), 'r') as cache_file:
+            return json.load(cache_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+def write_cache_file(name, data):
+    """
+    Atomically replaces the cache file name with data serialized as JSON.
+    Caches are only an optimization, so failing to write one (e.g. on a
+    read-only /var) is silently ignored.
+    """
+    cache_dir = get_cache_dir()
+    tmp = None
+    try:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, prefix=".%s." % name)
+        with os.fdopen(fd, 'w') as cache_file:
+            cache_file.write(data if isinstance(data, str) else json.dumps(data, separators=(',', ':')))
+        os.rename(tmp, os.path.join(cache_dir, name))
+        tmp = None
+    except (IOError, OSError, TypeError, ValueError):
+        pass
+    finally:
+        if tmp and os.path.exists(tmp):
+            os.unlink(tmp)
+
+def load_config_file(path):
+    """
+    Parses a YAML configuration file once per process.  The parsed content
+    is also kept on disk in a JSON cache keyed by path and mtime, so the
+    YAML parser only runs again when the file changes.  The returned
+    structure is shared and must not be modified.
+    """
+    st = os.stat(path)
+    stamp = [st.st_mtime, st.st_size]
+    cached = load_config_file.cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    cache_name = "config-%s.json" % hashlib.sha1(path.encode('utf-8')).hexdigest()
+    on_disk = read_cache_file(cache_name)
+    if on_disk is not None and on_disk.get("path") == path and on_disk.get("stamp") == stamp:
+        data = on_disk["data"]
+    else:
+        with open(path, 'r') as conf_file:
+            data = yaml_load(conf_file, Loader=YamlLoader)
+        # Only cache what survives the round trip through JSON unchanged
+        try:
+            blob = json.dumps({"path": path, "stamp": stamp, "data": data}, separators=(',', ':'))
+            if json.loads(blob)["data"] == data:
+                write_cache_file(cache_name, blob)
+        except (TypeError, ValueError):
+            pass
+    load_config_file.cache[path] = (stamp, data)
+    return data
+load_config_file.cache = {}
+
 def get_atomic_config():
     # Returns the atomic configuration file (/etc/atomic.conf)
     # in a dict
     # :return: dict based structure of the atomic config file
     if not os.path.exists(ATOMIC_CONF):
         raise ValueError("{} does not exist".format(ATOMIC_CONF))
-    with open(ATOMIC_CONF, 'r') as conf_file:
-        return yaml_load(conf_file)
+    return load_config_file(ATOMIC_CONF)
 
 def get_atomic_config_item(config_items, atomic_config=None):
     """
@@ -349,13 +483,12 @@ def get_scanners():
         raise ValueError("{} does not exist".format(ATOMIC_CONFD))
     files = [os.path.join(ATOMIC_CONFD, x) for x in os.listdir(ATOMIC_CONFD) if os.path.isfile(os.path.join(ATOMIC_CONFD, x))]
     for f in files:
-        with open(f, 'r') as conf_file:
-            temp_conf = yaml_load(conf_file)
-            try:
-                if temp_conf.get('type') == "scanner":
-                    scanners.append(temp_conf)
-            except AttributeError:
-                pass
+        temp_conf = load_config_file(f)
+        try:
+            if temp_conf.get('type') == "scanner":
+                scanners.append(temp_conf)
+        except AttributeError:
+            pass
     return scanners
 
 def default_docker():
@@ -435,3 +568,54 @@ def find_remote_image(client, image):
 
 def is_user_mode():
     return os.geteuid() != 0
+
+def parallel_map(func, items, workers=8):
+    """
+    Returns [func(x) for x in items], running up to workers calls
+    concurrently in threads.  The results keep the order of items.
+    items can be any iterable, it is consumed as workers become free.
+    If a call, or the iteration, raises, no new calls are started and
+    the exception is raised again once the running ones are done.
+    """
+    if isinstance(items, (list, tuple)) and len(items) <= 1:
+        workers = 1
+    if workers <= 1:
+        return [func(x) for x in items]
+
+    results = {}
+    errors = []
+    lock = threading.Lock()
+    indexed = enumerate(items)
+
+    def worker():
+        while True:
+            with lock:
+                if errors:
+                    return
+                try:
+                    i, item = next(indexed)
+                except StopIteration:
+                    return
+                except Exception as e: # pylint: disable=broad-except
+                    errors.append(e)
+                    return
+            try:
+                result = func(item)
+            except Exception as e: # pylint: disable=broad-except
+                with lock:
+                    errors.append(e)
+                continue
+            with lock:
+                results[i] = result
+
+    if isinstance(items, (list, tuple)):
+        workers = min(workers, len(items))
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+    return [results[i] for i in sorted(results)]
@@ -150,7 +150,7 @@ class Verify(Atomic):
                     iid = layer['Id']
                     local_nvr = layer['Version']
                     no_version = False
-                    image = self.d.inspect_image(iid)
+                    image = self.layer_resolver.inspect(iid)
                     labels = image.get('Config', []).get('Labels', [])
                     if 'Authoritative_Registry' in labels and 'Name' in labels:
                         tag = os.path.join(labels['Authoritative_Registry'], labels['Name'])
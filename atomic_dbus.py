@@ -14,6 +14,7 @@ from Atomic.storage import Storage
 from Atomic.diff import Diff
 from Atomic.scan import Scan
 from Atomic.ps import Ps
+from Atomic import objectindex
 
 class atomic_dbus(slip.dbus.service.Object):
     default_polkit_auth_required = "org.atomic.readwrite"
@@ -59,6 +60,16 @@ class atomic_dbus(slip.dbus.service.Object):
         self.scheduler_thread.start()
         self.results = dict()
         self.results_lock = threading.Lock()
+        # Images, Ps and VulnerableInfo are answered from memory and only
+        # computed again once Docker, OSTree or the scan results changed
+        self.index = objectindex.ObjectIndex()
+        self.index.add_view("Images", self._Images,
+                            [objectindex.DOCKER, objectindex.OSTREE, objectindex.CHECKOUTS, objectindex.SCAN])
+        self.index.add_view("Ps", self._Ps,
+                            [objectindex.DOCKER, objectindex.CHECKOUTS, objectindex.SCAN])
+        self.index.add_view("VulnerableInfo", self._VulnerableInfo, [objectindex.SCAN])
+        self.index.watch_host(self.atomic)
+        self.index.warm_up()
 
     def Scheduler(self):
         while True:
@@ -264,27 +275,45 @@ class atomic_dbus(slip.dbus.service.Object):
     @slip.dbus.polkit.require_auth("org.atomic.read")
     @dbus.service.method("org.atomic", in_signature='', out_signature='s')
     def Images(self):
+        return self.index.get("Images")
+
+    # The index builds its views from its own threads, so they do not
+    # share self.atomic with the other methods
+    def _Images(self):
+        atomic = Atomic()
         args = self.Args()
-        self.atomic.set_args(args)
-        return json.dumps(self.atomic.images())
+        atomic.set_args(args)
+        return json.dumps(atomic.images())
 
     # The Vulnerable method will send back information that says
     # whether or not an installed container image is vulnerable
     @slip.dbus.polkit.require_auth("org.atomic.read")
     @dbus.service.method("org.atomic", in_signature='', out_signature='s')
     def VulnerableInfo(self):
+        return self.index.get("VulnerableInfo")
+
+    def _VulnerableInfo(self):
+        atomic = Atomic()
         args = self.Args()
-        self.atomic.set_args(args)
-        return self.atomic.get_all_vulnerable_info()
+        atomic.set_args(args)
+        return atomic.get_all_vulnerable_info()
 
     # The Ps method will list all containers on the system.
     @slip.dbus.polkit.require_auth("org.atomic.read")
     @dbus.service.method("org.atomic", in_signature='', out_signature='s')
     def Ps(self):
+        # Only the containers are cached, the state of the system
+        # containers is read from runc on every call
+        ps = Ps()
+        args = self.Args()
+        ps.set_args(args)
+        return json.dumps(ps.update_runtime_states(self.index.get("Ps")))
+
+    def _Ps(self):
         ps = Ps()
         args = self.Args()
         ps.set_args(args)
-        return json.dumps(ps.ps())
+        return ps.ps()
 
 if __name__ == "__main__":
     mainloop = GLib.MainLoop()
@@ -0,0 +1,109 @@
+#!/usr/bin/python -Es
+#
+# Benchmark for image name matching on hosts with many tags.
+#
+# Synthetic images carrying --tags tags in total, spread over a few
+# registries and repositories, are matched against a set of literal and
+# glob names.  The median time of each approach is reported:
+#
+#   fnmatch:       one image_by_name() lookup per name, matching every tag
+#                  with fnmatch.fnmatch() as image_by_name() used to
+#   image_by_name: one image_by_name() lookup per name, with the pattern
+#                  compiled once
+#   batch:         a single images_by_names() pass for all the names
+#
+# Run from the top of the source tree:
+#
+#   python tests/benchmarks/bench_name_match.py [-n RUNS] [--tags N] [--json]
+
+import os
+import sys
+import json
+import argparse
+import time
+from fnmatch import fnmatch as matches
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from Atomic import util # pylint: disable=wrong-import-position
+
+NAMES = ["busybox", "mirror0.example.com/app17:1.0", "app3*", "*/app42:*",
+         "rhel7/rsyslog", "app1?:latest", "does-not-exist", "app[12]9:2.*"]
+
+
+def make_images(tags):
+    images = []
+    for i in range(tags // 4):
+        repo = "app%d" % (i % 500)
+        reg = "mirror%d.example.com" % (i % 8)
+        images.append({"Id": "%064x" % i,
+                       "RepoTags": ["%s/%s:%d.%d" % (reg, repo, i % 7, j) for j in range(3)] +
+                                   ["%s/rhel7/rsyslog:%d" % (reg, i)]})
+    return images
+
+
+def fnmatch_image_by_name(img_name, images):
+    i_reg, i_rep, i_tag = util.decompose(img_name)
+    if not i_reg:
+        i_reg = '*'
+    if not i_tag:
+        i_tag = '*'
+    valid_images = []
+    for i in images:
+        for t in i['RepoTags']:
+            reg, rep, tag = util.decompose(t)
+            if matches(reg, i_reg) and matches(rep, i_rep) and matches(tag, i_tag):
+                valid_images.append(i)
+                break
+            if rep.endswith(img_name):
+                valid_images.append(i)
+                break
+    return valid_images
+
+
+def _time(func, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.time()
+        func()
+        samples.append(time.time() - start)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="image name matching benchmark")
+    parser.add_argument("-n", "--runs", type=int, default=5,
+                        help="runs per measurement, the median is reported")
+    parser.add_argument("--tags", type=int, default=20000,
+                        help="number of synthetic tags")
+    parser.add_argument("--json", action="store_true", default=False,
+                        help="print results as JSON")
+    args = parser.parse_args()
+
+    images = make_images(args.tags)
+    expected = dict((n, fnmatch_image_by_name(n, images)) for n in NAMES)
+    if util.images_by_names(NAMES, images=images) != expected:
+        sys.exit("images_by_names() and image_by_name() disagree")
+
+    results = [
+        {"method": "fnmatch",
+         "time": _time(lambda: [fnmatch_image_by_name(n, images) for n in NAMES], args.runs)},
+        {"method": "image_by_name",
+         "time": _time(lambda: [util.image_by_name(n, images=images) for n in NAMES], args.runs)},
+        {"method": "batch",
+         "time": _time(lambda: util.images_by_names(NAMES, images=images), args.runs)},
+    ]
+
+    if args.json:
+        print(json.dumps({"tags": args.tags, "names": len(NAMES), "results": results}, indent=4))
+        return
+
+    col_out = "{0:16} {1:>12} {2:>8}"
+    print(col_out.format("METHOD", "TIME", "SPEEDUP"))
+    for r in results:
+        print(col_out.format(r["method"], "%.1f ms" % (r["time"] * 1000),
+                             "%.1fx" % (results[0]["time"] / max(r["time"], 1e-9))))
+
+if __name__ == '__main__':
+    main()
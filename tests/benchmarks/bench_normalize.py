@@ -0,0 +1,120 @@
+#!/usr/bin/python -Es
+#
+# Benchmark for the normalization applied by AtomicDocker to API results.
+#
+# Synthetic responses shaped like the ones returned by a busy host are
+# normalized both with the generic iter_subs walk and with the per-method
+# normalizers, and the median time of each is reported:
+#
+#   images:            images(all=True) with --images entries
+#   images quiet:      images(all=True, quiet=True)
+#   inspect_container: inspect_container() of a container with a large
+#                      Config and GraphDriver, repeated --images times
+#
+# Run from the top of the source tree:
+#
+#   python tests/benchmarks/bench_normalize.py [-n RUNS] [--images N] [--json]
+
+import os
+import sys
+import copy
+import json
+import argparse
+import hashlib
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from Atomic.client import iter_subs, NORMALIZERS # pylint: disable=wrong-import-position
+
+
+def _sha(i):
+    return "sha256:" + hashlib.sha256(str(i).encode('utf-8')).hexdigest()
+
+
+def make_images(count):
+    return [{"Id": _sha(i),
+             "ParentId": _sha(i - 1) if i else "",
+             "RepoTags": ["registry.example.com/image%d:latest" % i],
+             "RepoDigests": ["registry.example.com/image%d@%s" % (i, _sha(-i))],
+             "Created": 1480000000 + i,
+             "Size": 1000000 + i,
+             "VirtualSize": 1000000 + i,
+             "Labels": {"Name": "image%d" % i, "Version": "1.0", "Release": str(i)}}
+            for i in range(count)]
+
+
+def make_container(i):
+    env = ["VAR%d=value%d" % (j, j) for j in range(50)]
+    return {"Id": hashlib.sha256(str(i).encode('utf-8')).hexdigest(),
+            "Image": _sha(i),
+            "Name": "/container%d" % i,
+            "State": {"Running": True, "Pid": 1000 + i, "Status": "running"},
+            "Config": {"Image": "image%d" % i, "Env": env,
+                       "Labels": dict(("label%d" % j, "value%d" % j) for j in range(50)),
+                       "Cmd": ["/bin/sh", "-c", "sleep infinity"]},
+            "GraphDriver": {"Name": "overlay2",
+                            "Data": dict(("Dir%d" % j, "/var/lib/docker/overlay2/%d/diff" % j)
+                                         for j in range(20))},
+            "Mounts": [{"Source": "/srv/%d" % j, "Destination": "/data/%d" % j} for j in range(10)],
+            "NetworkSettings": {"Networks": {"bridge": {"IPAddress": "172.17.0.2"}}}}
+
+
+def _time(func, payload, runs):
+    samples = []
+    for _ in range(runs):
+        # Both normalizers work in place, so each run gets a fresh copy
+        data = copy.deepcopy(payload)
+        start = time.time()
+        func(data)
+        samples.append(time.time() - start)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AtomicDocker normalization benchmark")
+    parser.add_argument("-n", "--runs", type=int, default=5,
+                        help="runs per measurement, the median is reported")
+    parser.add_argument("--images", type=int, default=10000,
+                        help="number of synthetic images")
+    parser.add_argument("--json", action="store_true", default=False,
+                        help="print results as JSON")
+    args = parser.parse_args()
+
+    images = make_images(args.images)
+    containers = [make_container(i) for i in range(args.images)]
+    cases = [("images", "images", images),
+             ("images quiet", "images", [i["Id"] for i in images]),
+             ("inspect_container", "inspect_container", containers)]
+
+    def each(func):
+        def run(payload):
+            for item in payload:
+                func(item)
+        return run
+
+    results = []
+    for label, method, payload in cases:
+        if method == "inspect_container":
+            generic = _time(each(iter_subs), payload, args.runs)
+            targeted = _time(each(NORMALIZERS[method]), payload, args.runs)
+        else:
+            generic = _time(iter_subs, payload, args.runs)
+            targeted = _time(NORMALIZERS[method], payload, args.runs)
+        results.append({"response": label, "iter_subs": generic, "normalizer": targeted})
+
+    if args.json:
+        print(json.dumps({"images": args.images, "results": results}, indent=4))
+        return
+
+    col_out = "{0:20} {1:>12} {2:>12} {3:>8}"
+    print(col_out.format("RESPONSE", "ITER_SUBS", "NORMALIZER", "SPEEDUP"))
+    for r in results:
+        print(col_out.format(r["response"],
+                             "%.1f ms" % (r["iter_subs"] * 1000),
+                             "%.1f ms" % (r["normalizer"] * 1000),
+                             "%.1fx" % (r["iter_subs"] / max(r["normalizer"], 1e-9))))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/python -Es
+#
+# Cold-start benchmark for the atomic CLI.
+#
+# Every measurement runs in a fresh interpreter, so the numbers include
+# interpreter startup and all module imports, which is what matters for
+# monitoring scripts that invoke atomic many times per minute.
+#
+# For each subcommand two figures are reported:
+#
+#   parse:    time for 'atomic <subcommand> --help', i.e. everything up to
+#             and including argument parsing
+#   dispatch: time for importing the class implementing the subcommand,
+#             which is only paid once the subcommand is dispatched
+#
+# Run from the top of the source tree:
+#
+#   python tests/benchmarks/bench_startup.py [-n RUNS] [--json]
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import time
+
+SUBCOMMANDS = [
+    (["diff"], "Atomic.diff.Diff"),
+    (["help"], "Atomic.help.AtomicHelp"),
+    (["info"], None),
+    (["images", "list"], None),
+    (["images", "delete"], "Atomic.delete.Delete"),
+    (["mount"], "Atomic.mount.Mount"),
+    (["ps"], "Atomic.ps.Ps"),
+    (["run"], "Atomic.run.Run"),
+    (["scan"], "Atomic.scan.Scan"),
+    (["storage", "export"], "Atomic.storage.Storage"),
+    (["top"], "Atomic.top.Top"),
+    (["verify"], "Atomic.verify.Verify"),
+    (["version"], None),
+]
+
+IMPORT_SNIPPET = """
+import importlib
+module, _, name = "%s".rpartition(".")
+getattr(importlib.import_module(module), name)
+"""
+
+
+def _time_command(cmd, env, runs):
+    samples = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(runs):
+            start = time.time()
+            subprocess.call(cmd, env=env, stdout=devnull, stderr=devnull)
+            samples.append(time.time() - start)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="atomic cold-start benchmark")
+    parser.add_argument("-n", "--runs", type=int, default=5,
+                        help="runs per measurement, the median is reported")
+    parser.add_argument("--json", action="store_true", default=False,
+                        help="print results as JSON")
+    args = parser.parse_args()
+
+    topdir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = topdir
+    atomic = os.path.join(topdir, "atomic")
+
+    baseline = _time_command([sys.executable, "-c", "pass"], env, args.runs)
+    results = []
+    for argv, klass in SUBCOMMANDS:
+        parse = _time_command([sys.executable, atomic] + argv + ["--help"], env, args.runs)
+        dispatch = 0.0
+        if klass:
+            snippet = IMPORT_SNIPPET % klass
+            dispatch = _time_command([sys.executable, "-c", snippet], env, args.runs)
+            # Only account for the import itself, not interpreter startup.
+            dispatch = max(dispatch - baseline, 0.0)
+        results.append({"subcommand": " ".join(argv),
+                        "parse": parse,
+                        "dispatch": dispatch,
+                        "total": parse + dispatch})
+
+    if args.json:
+        print(json.dumps({"interpreter": baseline, "results": results}, indent=4))
+        return
+
+    print("interpreter startup: %.1f ms\n" % (baseline * 1000))
+    col_out = "{0:20} {1:>10} {2:>10} {3:>10}"
+    print(col_out.format("SUBCOMMAND", "PARSE", "DISPATCH", "TOTAL"))
+    for r in results:
+        print(col_out.format(r["subcommand"],
+                             "%.1f ms" % (r["parse"] * 1000),
+                             "%.1f ms" % (r["dispatch"] * 1000),
+                             "%.1f ms" % (r["total"] * 1000)))
+
+if __name__ == '__main__':
+    main()
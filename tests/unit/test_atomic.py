@@ -0,0 +1,54 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from Atomic import util
+from Atomic.atomic import Atomic
+from Atomic.syscontainers import SystemContainers
+
+
+class FakeDocker(object):
+    def inspect_image(self, image):
+        return {'Id' : 'aaa111', 'RepoTags' : [image]}
+
+
+class TestInspectImage(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ['ATOMIC_CACHE_DIR'] = os.path.join(self.tmpdir, 'cache')
+        os.environ['ATOMIC_OSTREE_REPO'] = os.path.join(self.tmpdir, 'repo')
+        os.makedirs(os.path.join(self.tmpdir, 'repo', 'refs', 'heads', 'ociimage'))
+        self.atomic_conf = util.ATOMIC_CONF
+        util.ATOMIC_CONF = os.path.join(self.tmpdir, 'atomic.conf')
+        with open(util.ATOMIC_CONF, 'w') as f:
+            f.write('default_docker: docker\n')
+
+    def tearDown(self):
+        util.ATOMIC_CONF = self.atomic_conf
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmpdir)
+
+    def test_docker_image_does_not_load_ostree(self):
+        if 'gi.repository' in sys.modules:
+            self.skipTest("the GObject introspection bindings are already loaded")
+        atomic = Atomic()
+        atomic.d = FakeDocker()
+        atomic._syscontainers = SystemContainers() # pylint: disable=protected-access
+        self.assertEqual(atomic._inspect_image('busybox')['Id'], 'aaa111') # pylint: disable=protected-access
+        self.assertFalse('gi.repository' in sys.modules)
+
+    def test_system_image_branch(self):
+        syscontainers = SystemContainers()
+        syscontainers.user = False
+        self.assertFalse(syscontainers.has_system_container_branch('busybox'))
+        open(os.path.join(self.tmpdir, 'repo', 'refs', 'heads', 'ociimage', 'busybox-latest'), 'w').close()
+        self.assertTrue(syscontainers.has_system_container_branch('busybox'))
+        self.assertTrue(syscontainers.has_system_container_branch('oci:busybox:latest'))
+        self.assertFalse(syscontainers.has_system_container_branch('busybox:1.0'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+from Atomic import objectindex
+from Atomic.ps import Ps
+
+
+class TestObjectIndex(unittest.TestCase):
+    def setUp(self):
+        self.builds = []
+        self.index = objectindex.ObjectIndex()
+        self.index.add_view("Images", lambda: self._build("Images"),
+                            [objectindex.OSTREE, objectindex.SCAN])
+        self.index.add_view("VulnerableInfo", lambda: self._build("VulnerableInfo"),
+                            [objectindex.SCAN])
+
+    def _build(self, name):
+        self.builds.append(name)
+        return "%s-%d" % (name, len(self.builds))
+
+    def test_cached_until_source_changes(self):
+        self.assertEqual(self.index.get("Images"), "Images-1")
+        self.assertEqual(self.index.get("Images"), "Images-1")
+        self.index.mark_dirty(objectindex.OSTREE)
+        self.assertEqual(self.index.get("Images"), "Images-2")
+        self.assertEqual(self.builds, ["Images", "Images"])
+
+    def test_unrelated_source(self):
+        self.index.get("VulnerableInfo")
+        self.index.mark_dirty(objectindex.OSTREE)
+        self.index.get("VulnerableInfo")
+        self.assertEqual(self.builds, ["VulnerableInfo"])
+
+    def test_unwatched_source(self):
+        self.index.unwatched.add(objectindex.SCAN)
+        self.index.get("VulnerableInfo")
+        self.index.get("VulnerableInfo")
+        self.assertEqual(self.builds, ["VulnerableInfo", "VulnerableInfo"])
+
+
+class FakeSystemContainers(object):
+    def __init__(self):
+        self.states = {"etcd" : "running"}
+
+    def get_container_runtime_info(self, container):
+        return {"status" : self.states[container]}
+
+
+class TestPsRuntimeStates(unittest.TestCase):
+    def test_state_change_without_event(self):
+        ps = Ps()
+        ps._syscontainers = FakeSystemContainers() # pylint: disable=protected-access
+        builds = []
+        def build():
+            builds.append("Ps")
+            return [{"Id" : "etcd", "Type" : "systemcontainer", "State" : "running"},
+                    {"Id" : "abc", "Type" : "docker", "State" : {"Running" : True}}]
+        index = objectindex.ObjectIndex()
+        index.add_view("Ps", build, [objectindex.DOCKER, objectindex.CHECKOUTS, objectindex.SCAN])
+
+        self.assertEqual(ps.update_runtime_states(index.get("Ps"))[0]["State"], "running")
+        # The container exits, runc does not touch its state directory
+        ps.syscontainers.states["etcd"] = "stopped"
+        containers = ps.update_runtime_states(index.get("Ps"))
+        self.assertEqual(containers[0]["State"], "stopped")
+        self.assertEqual(containers[1]["State"], {"Running" : True})
+        self.assertEqual(builds, ["Ps"])
+        # The cached payload is not modified
+        self.assertEqual(index.get("Ps")[0]["State"], "running")
+
+if __name__ == '__main__':
+    unittest.main()
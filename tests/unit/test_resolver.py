@@ -0,0 +1,69 @@
+import unittest
+
+from Atomic import util
+from Atomic.resolver import ObjectResolver
+
+IMAGES = [{'Id': 'aaa111', 'RepoTags': ['docker.io/centos:latest']},
+          {'Id': 'aab222', 'RepoTags': ['docker.io/busybox:latest', 'docker.io/busybox:atest1']},
+          {'Id': 'bbb333', 'RepoTags': ['registry.example.com/rhel7/rsyslog:7.3']},
+          {'Id': 'ccc444', 'RepoTags': ['atomic-test-1:latest']},
+          {'Id': 'ccc555', 'RepoTags': ['atomic-test-2:latest']},
+          {'Id': 'ddd666', 'RepoTags': None}]
+
+CONTAINERS = [{'Id': '111aaa', 'Names': ['/web']},
+              {'Id': '111bbb', 'Names': ['/web-backup']},
+              {'Id': '222ccc', 'Names': ['/db']}]
+
+
+class TestObjectResolver(unittest.TestCase):
+    def setUp(self):
+        self.resolver = ObjectResolver(lambda: IMAGES, lambda: CONTAINERS)
+
+    def _ids(self, objs):
+        return [x['Id'] for x in objs]
+
+    def test_images_by_id(self):
+        self.assertEqual(self._ids(self.resolver.images_by_id('aa')), ['aaa111', 'aab222'])
+        self.assertEqual(self._ids(self.resolver.images_by_id('ddd666')), ['ddd666'])
+        self.assertEqual(self.resolver.images_by_id('eee'), [])
+
+    def test_images_by_name_same_as_util(self):
+        tagged = [i for i in IMAGES if i['RepoTags']]
+        for name in ('centos', '/centos:latest', 'busybox:*atest*', 'atomic-test-*',
+                     'rhel7/rsyslog', 'rsyslog', 'docker.io/busybox', 'missing'):
+            self.assertEqual(self._ids(self.resolver.images_by_name(name)),
+                             self._ids(util.image_by_name(name, images=tagged)), name)
+
+    def test_resolve_names(self):
+        names = ['centos', 'busybox:*atest*', 'atomic-test-*', 'rsyslog', 'missing']
+        expected = dict((name, self._ids(self.resolver.images_by_name(name))) for name in names)
+        resolver = ObjectResolver(lambda: IMAGES, lambda: CONTAINERS)
+        resolver.resolve_image_names(names)
+        self.assertEqual(sorted(resolver.image_index.names.keys()), sorted(names))
+        for name in names:
+            self.assertEqual(self._ids(resolver.images_by_name(name)), expected[name], name)
+
+    def test_containers(self):
+        self.assertEqual(self._ids(self.resolver.containers_by_name('/web')), ['111aaa', '111bbb'])
+        self.assertEqual(self._ids(self.resolver.containers_by_id('111')), ['111aaa', '111bbb'])
+        self.assertEqual(self._ids(self.resolver.containers_by_glob('web')), ['111aaa'])
+        self.assertEqual(self._ids(self.resolver.containers_by_glob('w*')), ['111aaa', '111bbb'])
+        self.assertEqual(self._ids(self.resolver.containers_by_glob('222')), ['222ccc'])
+
+    def test_lazy_listings(self):
+        listed = []
+        def listing(name, objs):
+            def get():
+                listed.append(name)
+                return objs
+            return get
+        resolver = ObjectResolver(listing('images', IMAGES), listing('containers', CONTAINERS))
+        resolver.containers_by_name('/db')
+        resolver.containers_by_id('111')
+        self.assertEqual(listed, ['containers'])
+        resolver.images_by_id('aa')
+        resolver.images_by_name('centos')
+        self.assertEqual(listed, ['containers', 'images'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from Atomic import syscontainers
+from Atomic.syscontainers import SystemContainers, RepoLock
+
+
+def layer_ref(c):
+    return "ociimage/" + c * 64
+
+
+class FakeError(Exception):
+    pass
+
+
+class FakeGLib(object):
+    Error = FakeError
+
+
+class FakePath(object):
+    def __init__(self, path):
+        self.path = path
+
+    def get_path(self):
+        return self.path
+
+
+class FakeRepo(object):
+    """
+    Refs, and the (manifest, layers) of the commits still in the repository.
+    """
+    def __init__(self, path, refs, commits):
+        self.path = path
+        self.refs = refs
+        self.commits = commits
+
+    def get_path(self):
+        return FakePath(self.path)
+
+    def list_refs(self):
+        return True, self.refs
+
+
+class FakeSystemContainers(SystemContainers):
+    def __init__(self, checkouts): # pylint: disable=super-init-not-called
+        self.checkouts = checkouts
+
+    def _get_system_checkout_path(self):
+        return self.checkouts
+
+    def _get_commit_info(self, repo, rev):
+        if rev not in repo.commits:
+            raise FakeError(rev)
+        return {'Layers' : repo.commits[rev][1]}
+
+    def _image_manifest(self, repo, rev):
+        return repo.commits[rev][0]
+
+
+class TestOverlayWhiteouts(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_whiteout(self):
+        whiteout = SystemContainers._get_overlay_whiteout(self.tmpdir, "/etc/removed", stat.S_IFCHR | 0o000, 0)  # pylint: disable=protected-access
+        self.assertEqual(whiteout, "/etc/.wh.removed")
+        # Other character devices are kept as they are
+        self.assertEqual(SystemContainers._get_overlay_whiteout(self.tmpdir, "/dev/null", stat.S_IFCHR | 0o666, 259), None)  # pylint: disable=protected-access
+        self.assertEqual(SystemContainers._get_overlay_whiteout(self.tmpdir, "/etc/file", stat.S_IFREG | 0o644, 0), None)  # pylint: disable=protected-access
+
+    def test_opaque_directory(self):
+        os.makedirs(os.path.join(self.tmpdir, "var", "cache"))
+        os.makedirs(os.path.join(self.tmpdir, "var", "lib"))
+        try:
+            os.setxattr(os.path.join(self.tmpdir, "var", "cache"), "trusted.overlay.opaque", b"y")
+        except (AttributeError, OSError):
+            self.skipTest("trusted xattrs are not supported")
+        mode = stat.S_IFDIR | 0o755
+        self.assertEqual(SystemContainers._get_overlay_whiteout(self.tmpdir, "/var/cache", mode, 0),  # pylint: disable=protected-access
+                         "/var/cache/.wh..wh..opq")
+        self.assertEqual(SystemContainers._get_overlay_whiteout(self.tmpdir, "/var/lib", mode, 0), None)  # pylint: disable=protected-access
+
+
+class TestReachableRefs(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.checkouts = os.path.join(self.tmpdir, "checkouts")
+        os.makedirs(self.checkouts)
+        os.environ['ATOMIC_CACHE_DIR'] = os.path.join(self.tmpdir, 'cache')
+        self.glib = syscontainers.GLib
+        syscontainers.GLib = FakeGLib
+
+    def tearDown(self):
+        syscontainers.GLib = self.glib
+        del os.environ['ATOMIC_CACHE_DIR']
+        shutil.rmtree(self.tmpdir)
+
+    def _deploy(self, name, deployment, info):
+        path = os.path.join(self.checkouts, "%s.%d" % (name, deployment))
+        os.makedirs(path)
+        with open(os.path.join(path, "info"), "w") as info_file:
+            json.dump(info, info_file)
+        return path
+
+    def test_unreachable_refs(self):
+        flattened = lambda manifest: "ociflattened/" + hashlib.sha256(manifest.encode('utf-8')).hexdigest()
+        refs = {"ociimage/app-latest" : "app",
+                layer_ref("a") : "la", layer_ref("b") : "lb", layer_ref("c") : "lc", layer_ref("d") : "ld",
+                flattened("app-manifest") : "fa", flattened("old-manifest") : "fo",
+                flattened("gone-manifest") : "fg", "other" : "o"}
+        commits = {"app" : ("app-manifest", ["sha256:" + "a" * 64]),
+                   "old" : ("old-manifest", ["sha256:" + "b" * 64])}
+        repo = FakeRepo(os.path.join(self.tmpdir, "repo"), refs, commits)
+
+        # The running deployment comes from an image whose commit is pruned
+        # already, its layers are only known from its info.  The rollback
+        # slot comes from a deleted image whose commit is still there.
+        current = self._deploy("ctr", 0, {"ostree-commit" : "gone", "layers" : ["sha256:" + "c" * 64]})
+        self._deploy("ctr", 1, {"ostree-commit" : "old"})
+        os.symlink(current, os.path.join(self.checkouts, "ctr"))
+        # Deployments without a symlink are not installed
+        self._deploy("removed", 0, {"ostree-commit" : "old", "layers" : ["sha256:" + "d" * 64]})
+
+        system_containers = FakeSystemContainers(self.checkouts)
+        self.assertEqual(len(system_containers._get_deployed_infos()), 2)  # pylint: disable=protected-access
+        self.assertEqual(system_containers._get_unreachable_refs(repo),  # pylint: disable=protected-access
+                         [flattened("gone-manifest"), layer_ref("d")])
+
+    def test_no_checkouts(self):
+        repo = FakeRepo(os.path.join(self.tmpdir, "repo"), {layer_ref("a") : "la"}, {})
+        system_containers = FakeSystemContainers(os.path.join(self.tmpdir, "missing"))
+        self.assertEqual(system_containers._get_deployed_infos(), [])  # pylint: disable=protected-access
+        self.assertEqual(system_containers._get_unreachable_refs(repo), [layer_ref("a")])  # pylint: disable=protected-access
+
+    def test_prune_dockertar_digests(self):
+        repo = FakeRepo(os.path.join(self.tmpdir, "repo"), {layer_ref("a") : "la"}, {})
+        digests = {"layer1-10-1" : "a" * 64, "layer2-10-1" : "b" * 64, "layer3-10-1" : "c" * 64}
+        SystemContainers._prune_dockertar_digests(repo, digests, keep=set(["layer3-10-1"]))  # pylint: disable=protected-access
+        self.assertEqual(digests, {"layer1-10-1" : "a" * 64, "layer3-10-1" : "c" * 64})
+
+
+class TestRepoLock(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_prune_waits_for_pulls(self):
+        prune = RepoLock(self.tmpdir, exclusive=True)
+        with RepoLock(self.tmpdir):
+            with RepoLock(self.tmpdir):
+                self.assertFalse(prune.acquire(blocking=False))
+        self.assertTrue(prune.acquire(blocking=False))
+        self.assertFalse(RepoLock(self.tmpdir, exclusive=True).acquire(blocking=False))
+        prune.release()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import unittest
 import selinux
 
@@ -57,6 +60,60 @@ class TestAtomicUtil(unittest.TestCase):
         except util.FileNotFound:
             exception_raised = True
         self.assertTrue(exception_raised)
+    def test_load_config_file(self):
+        tmpdir = tempfile.mkdtemp()
+        os.environ['ATOMIC_CACHE_DIR'] = os.path.join(tmpdir, 'cache')
+        try:
+            path = os.path.join(tmpdir, 'atomic.conf')
+            with open(path, 'w') as f:
+                f.write('default_docker: docker\n')
+            conf = util.load_config_file(path)
+            self.assertEqual(conf, {'default_docker': 'docker'})
+            # The second lookup is served from memory
+            self.assertTrue(util.load_config_file(path) is conf)
+            # and a fresh process is served from the on-disk cache
+            util.load_config_file.cache.clear()
+            self.assertEqual(util.load_config_file(path), conf)
+            # Changing the file invalidates both
+            with open(path, 'w') as f:
+                f.write('default_docker: docker-latest\n')
+            self.assertEqual(util.load_config_file(path), {'default_docker': 'docker-latest'})
+        finally:
+            del os.environ['ATOMIC_CACHE_DIR']
+            shutil.rmtree(tmpdir)
+
+    def test_parallel_map(self):
+        self.assertEqual(util.parallel_map(lambda x: x * 2, range(100), workers=4),
+                         [x * 2 for x in range(100)])
+        self.assertEqual(util.parallel_map(lambda x: x, []), [])
+
+    def test_parallel_map_exception(self):
+        def fail(x):
+            if x == 3:
+                raise ValueError(x)
+            return x
+        self.assertRaises(ValueError, util.parallel_map, fail, range(10))
+
+    def test_parallel_map_generator(self):
+        def items():
+            for i in range(10):
+                yield i
+            raise ValueError("iteration")
+        self.assertEqual(util.parallel_map(lambda x: x * 2, (i for i in range(10)), workers=4),
+                         [i * 2 for i in range(10)])
+        self.assertRaises(ValueError, util.parallel_map, lambda x: x, items(), workers=4)
+
+    def test_images_by_names(self):
+        images = [{'Id': '1', 'RepoTags': ['docker.io/busybox:latest', 'docker.io/busybox:atest1']},
+                  {'Id': '2', 'RepoTags': ['registry.example.com/rhel7/rsyslog:7.3']},
+                  {'Id': '3', 'RepoTags': ['atomic-test-1:latest']},
+                  {'Id': '4', 'RepoTags': ['atomic-test-2:latest']}]
+        names = ['busybox:*atest*', 'atomic-test-*', 'rsyslog', '/busybox:latest',
+                 'rhel7/rsyslog', 'atomic-test-[2]', 'nothing']
+        found = util.images_by_names(names, images=images)
+        for name in names:
+            self.assertEqual(found[name], util.image_by_name(name, images=images))
+
 
 if __name__ == '__main__':
     unittest.main()